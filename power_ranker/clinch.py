@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+"""Exact clinch, elimination and magic numbers from the remaining schedule
+
+Whether a team can still make (or miss) the playoffs only depends on who
+wins the remaining games, so each question is a flow feasibility problem
+over the remaining schedule, as in the classic baseball elimination
+argument. Points for tiebreaks can't be known ahead of time, so ties on
+wins go to the team when checking elimination, and against it when
+checking a clinch.
+
+With wild cards, the checks search over sets of rivals. Rivals that
+can't matter are pruned first and the rest are ordered by slack, so
+only a small share of the sets reach a flow. A search that still runs
+past MAX_SETS sets gives the safe answer (not clinched, not
+eliminated), so a clinch or elimination is never reported falsely.
+"""
+
+import logging
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_flow
+
+__author__ = 'Ryne Carbone'
+
+logger = logging.getLogger(__name__)
+
+# Most rival sets tried by one clinch or elimination check
+MAX_SETS = 200000
+
+
+def calc_clinch_status(teams, df_remaining, n_wc):
+  """Find which teams have clinched or been eliminated, and their magic numbers
+
+  The magic number is the fewest remaining games a team must win to
+  clinch a playoff spot no matter what else happens. It is 0 once
+  clinched, and missing if winning out is not enough on its own.
+  :param teams: data frame with team data, including wins and divisionId
+  :param df_remaining: data frame with remaining games and team positions
+  :param n_wc: number of wild card spots
+  :return: data frame with clinch/elimination flags and magic number for each team
+  """
+  wins = teams.wins.values.astype(float)
+  _, div_pos = np.unique(teams.divisionId.values, return_inverse=True)
+  games = df_remaining[['home_idx', 'away_idx']].values.reshape(-1, 2)
+  n_left = np.bincount(games.ravel(), minlength=wins.size)
+  rows = []
+  for team in range(wins.size):
+    eliminated_div = is_eliminated_div(wins, games, div_pos, team)
+    eliminated = eliminated_div and is_eliminated(wins, games, div_pos, team, n_wc)
+    magic = np.nan if eliminated else calc_magic_number(wins, games, div_pos, team, n_wc)
+    rows.append({'team_id': teams.team_id.values[team],
+                 'games_left': n_left[team],
+                 'clinched_div': is_clinched_div(wins, games, div_pos, team),
+                 'clinched_playoffs': magic == 0,
+                 'eliminated_div': eliminated_div,
+                 'eliminated_playoffs': eliminated,
+                 'magic_number': magic})
+  return pd.DataFrame(rows)
+
+
+def calc_magic_number(wins, games, div_pos, team, n_wc):
+  """Binary search for the fewest wins that guarantee a playoff spot
+
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param div_pos: division position for each team position
+  :param team: team position to check
+  :param n_wc: number of wild card spots
+  :return: magic number, or nan if the team can't clinch on its own
+  """
+  n_left = np.sum(games == team)
+  if not is_clinched(wins, games, div_pos, team, n_wc, n_left):
+    return np.nan
+  low, high = 0, n_left
+  while low < high:
+    mid = (low + high) // 2
+    if is_clinched(wins, games, div_pos, team, n_wc, mid):
+      high = mid
+    else:
+      low = mid + 1
+  return low
+
+
+def is_clinched_div(wins, games, div_pos, team):
+  """Check if no division rival can catch the team, even if it loses out
+
+  Only one rival has to catch up, and winning all of its own games is
+  that rival's best case, so no flow is needed.
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param div_pos: division position for each team position
+  :param team: team position to check
+  :return: True if the division is clinched
+  """
+  n_left = np.bincount(games.ravel(), minlength=wins.size)
+  rivals = (div_pos == div_pos[team]) & (np.arange(wins.size) != team)
+  return not np.any(wins[rivals] + n_left[rivals] >= wins[team])
+
+
+def is_eliminated_div(wins, games, div_pos, team):
+  """Check if the team can't win its division, even if it wins out
+
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param div_pos: division position for each team position
+  :param team: team position to check
+  :return: True if eliminated from the division title
+  """
+  max_wins = wins[team] + np.sum(games == team)
+  rivals = (div_pos == div_pos[team]) & (np.arange(wins.size) != team)
+  return not can_hold_below(wins, games, team, rivals, max_wins)
+
+
+def is_eliminated(wins, games, div_pos, team, n_wc):
+  """Check if the team can't make the playoffs, even if it wins out
+
+  The team gets in unless n_wc teams that are not division winners
+  finish with more wins. If a set S of teams is allowed to pass it,
+  the non division winners among them number |S| minus the divisions
+  S touches, so only the largest such sets within the n_wc - 1 budget
+  need checking, with every other team held to the team's final wins.
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param div_pos: division position for each team position
+  :param team: team position to check
+  :param n_wc: number of wild card spots
+  :return: True if eliminated from the playoffs
+  """
+  others = np.arange(wins.size) != team
+  max_wins = wins[team] + np.sum(games == team)
+  # Games against the team are wins for the team, so don't count them for the rivals
+  reach = wins + np.bincount(games[~np.any(games == team, axis=1)].ravel(), minlength=wins.size)
+  forced = np.flatnonzero(others & (wins > max_wins))
+  candidates = np.flatnonzero(others & (wins <= max_wins) & (reach > max_wins))
+  # Try letting the teams hardest to hold below pass first
+  candidates = candidates[np.argsort(-(reach[candidates] - max_wins), kind='stable')]
+  budget = n_wc - 1
+  if count_extra(forced, div_pos) > budget:
+    return True
+  # Candidates that can be held below along with every other team never need to pass
+  capped = others.copy()
+  capped[forced] = False
+  if can_hold_below(wins, games, team, capped, max_wins):
+    return False
+  n_hit = np.unique(div_pos[np.concatenate([forced, candidates])]).size
+  k = min(candidates.size, max(n_hit + budget - forced.size, 0))
+  for n_tried, extra in enumerate(combinations(candidates, k)):
+    if n_tried == MAX_SETS:
+      logger.debug(f'Elimination search for team position {team} stopped after {MAX_SETS} sets')
+      return False
+    passing = np.concatenate([forced, extra]).astype(int)
+    if count_extra(passing, div_pos) > budget:
+      continue
+    capped = others.copy()
+    capped[passing] = False
+    if can_hold_below(wins, games, team, capped, max_wins):
+      return False
+  return True
+
+
+def is_clinched(wins, games, div_pos, team, n_wc, n_wins):
+  """Check if the team makes the playoffs in every completion, winning n_wins more games
+
+  The team misses out if its division is won by someone else and n_wc
+  other non division winners finish at least level with it. Teams already
+  level come for free, and the rest of such a set must all be able to
+  catch up at once. Sets of chasers are searched depth first, and a pair
+  that can't catch up together cuts every branch holding both of them,
+  so only the smallest sets made of compatible chasers reach the flow.
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param div_pos: division position for each team position
+  :param team: team position to check
+  :param n_wc: number of wild card spots
+  :param n_wins: number of its remaining games the team wins
+  :return: True if a playoff spot is guaranteed
+  """
+  n_losses = np.sum(games == team) - n_wins
+  final_wins = wins[team] + n_wins
+  others = np.arange(wins.size) != team
+  # Wins each team needs, and the most it can get from other games and the team's losses
+  need = np.ceil(final_wins - wins).astype(int)
+  vs_team = np.any(games == team, axis=1)
+  n_vs_team = np.bincount(games[vs_team].ravel(), minlength=wins.size)
+  n_other = np.bincount(games[~vs_team].ravel(), minlength=wins.size)
+  room = n_other + np.minimum(n_vs_team, max(n_losses, 0)) - need
+  level = np.flatnonzero(others & (need <= 0))
+  candidates = np.flatnonzero(others & (need > 0) & (room >= 0))
+  # Try the chasers with the most slack first
+  candidates = candidates[np.argsort(-room[candidates], kind='stable')]
+
+  def misses(chasers):
+    return div_pos[team] in div_pos[chasers] and count_extra(chasers, div_pos) >= n_wc
+
+  if misses(level):
+    return False
+  if not misses(np.concatenate([level, candidates])):
+    return True
+  # Two chasers catch up together only if the games they share leave them enough wins
+  n_shared = np.zeros((wins.size, wins.size), dtype=int)
+  np.add.at(n_shared, (games[~vs_team, 0], games[~vs_team, 1]), 1)
+  n_shared = n_shared + n_shared.T
+  pair_room = (n_other[:, None] + n_other[None, :] - n_shared
+               + np.minimum(n_vs_team[:, None] + n_vs_team[None, :], max(n_losses, 0))
+               - need[:, None] - need[None, :])
+  compatible = (pair_room >= 0).tolist()
+  # Plain python lookups keep the search cheap, most sets never reach the flow
+  div = div_pos.tolist()
+  need = need.tolist()
+  n_vs_team = n_vs_team.tolist()
+  n_other = n_other.tolist()
+  n_shared = n_shared.tolist()
+  level_count = [0] * (max(div) + 1)
+  for j in level:
+    level_count[div[j]] += 1
+  # A smallest set never needs more than one extra team per division and wild card
+  max_size = min(candidates.size, n_wc + len(level_count))
+  # Group the chasers by division, so a division left with a lone chaser is final
+  candidates = candidates[np.argsort(div_pos[candidates], kind='stable')].tolist()
+  n_sets = [0]
+
+  def knocks_out(extra):
+    """Check if a smallest set of chasers that knocks the team out can all catch up"""
+    # Every win the chasers need has to come from a game one of them plays
+    n_available = (sum(n_other[j] for j in extra) - sum(n_shared[a][b] for a, b in combinations(extra, 2))
+                   + min(n_losses, sum(n_vs_team[j] for j in extra)))
+    if sum(need[j] for j in extra) > n_available:
+      return False
+    return can_catch_up(wins, games, team, np.array(extra), final_wins, n_losses)
+
+  def search(extra, count, start):
+    """Extend a set of pairwise compatible chasers, True once one knocks the team out"""
+    for i in range(start, len(candidates)):
+      j = candidates[i]
+      # Only smallest sets are checked, where dropping any chaser lets the team in, so a
+      # division other than the team's can't be left with a lone chaser
+      last = div[extra[-1]] if extra else div[j]
+      if last != div[j] and last != div[team] and count[last] == 1:
+        break
+      if not all(compatible[j][c] for c in extra):
+        continue
+      n_sets[0] += 1
+      if n_sets[0] > MAX_SETS:
+        raise StopIteration
+      extended = extra + [j]
+      count[div[j]] += 1
+      excess = len(level) + len(extended) - sum(c > 0 for c in count)
+      if excess >= n_wc and count[div[team]] > 0:
+        # Supersets of a set that knocks the team out are never easier to reach
+        found = excess == n_wc and knocks_out(extended)
+      else:
+        found = len(extended) < max_size and search(extended, count, i+1)
+      count[div[j]] -= 1
+      if found:
+        return True
+    return False
+
+  try:
+    return not search([], level_count, 0)
+  except StopIteration:
+    logger.debug(f'Clinch search for team position {team} stopped after {MAX_SETS} sets')
+    return False
+
+
+def count_extra(members, div_pos):
+  """Count the teams in a set that can't be division winners
+
+  :param members: team positions in the set
+  :param div_pos: division position for each team position
+  :return: number of teams minus number of divisions represented
+  """
+  return len(members) - np.unique(div_pos[members]).size
+
+
+def can_hold_below(wins, games, team, capped, max_wins):
+  """Check if the capped teams can all finish with at most max_wins
+
+  The team wins all its games, and any game with an uncapped team goes to
+  that team, so only games between capped teams have to be distributed.
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param team: team position being checked, which wins out
+  :param capped: boolean mask of team positions held to max_wins
+  :param max_wins: most wins allowed for the capped teams
+  :return: True if some completion of the schedule holds them all
+  """
+  if np.any(wins[capped] > max_wins):
+    return False
+  shared = games[capped[games].all(axis=1) & ~np.any(games == team, axis=1)]
+  n_games = shared.shape[0]
+  if n_games == 0:
+    return True
+  room = np.floor(max_wins - wins).astype(int)
+  if room[np.unique(shared)].sum() < n_games:
+    return False
+  # Nodes: source, games, teams, sink
+  sink = 1 + n_games + wins.size
+  game_nodes = np.arange(1, n_games+1)
+  team_nodes = np.unique(shared)
+  tail = np.concatenate([np.zeros(n_games, dtype=int), game_nodes, game_nodes, 1 + n_games + team_nodes])
+  head = np.concatenate([game_nodes, 1 + n_games + shared[:, 0], 1 + n_games + shared[:, 1],
+                         np.full(team_nodes.size, sink)])
+  cap = np.concatenate([np.ones(3*n_games, dtype=int), room[team_nodes]])
+  return calc_max_flow(tail, head, cap, sink) == n_games
+
+
+def can_catch_up(wins, games, team, chasers, final_wins, n_losses):
+  """Check if the chasers can all reach final_wins at the same time
+
+  Games between two chasers go to one of them, other games involving a
+  chaser can go to it, and up to n_losses of the team's own games can go
+  to the chasers it plays.
+  :param wins: current wins for each team position
+  :param games: remaining games as (n_games, 2) team positions
+  :param team: team position being chased
+  :param chasers: team positions that must catch up
+  :param final_wins: wins each chaser needs
+  :param n_losses: number of the team's games it loses
+  :return: True if some completion of the schedule lets every chaser catch up
+  """
+  need = np.ceil(final_wins - wins[chasers]).astype(int)
+  is_chaser = np.zeros(wins.size, dtype=bool)
+  is_chaser[chasers] = True
+  involved = is_chaser[games].any(axis=1)
+  useful = games[involved]
+  n_games = useful.shape[0]
+  if n_games < need.sum():
+    return False
+  # Nodes: source, loss hub, games, chasers, sink
+  hub = 1
+  game_nodes = np.arange(2, n_games+2)
+  chaser_node = np.zeros(wins.size, dtype=int)
+  chaser_node[chasers] = np.arange(n_games+2, n_games+2+chasers.size)
+  sink = n_games + 2 + chasers.size
+  # Games against the team are fed through the hub, capping how many it loses
+  tail = [[0], np.where(np.any(useful == team, axis=1), hub, 0), chaser_node[chasers]]
+  head = [[hub], game_nodes, np.full(chasers.size, sink)]
+  cap = [[max(n_losses, 0)], np.ones(n_games), need]
+  for side in (0, 1):
+    to_chaser = is_chaser[useful[:, side]]
+    tail.append(game_nodes[to_chaser])
+    head.append(chaser_node[useful[to_chaser, side]])
+    cap.append(np.ones(to_chaser.sum()))
+  tail, head, cap = (np.concatenate(x).astype(int) for x in (tail, head, cap))
+  return calc_max_flow(tail, head, cap, sink) == need.sum()
+
+
+def calc_max_flow(tail, head, cap, sink):
+  """Maximum flow from node 0 to sink
+
+  :param tail: start node of each edge
+  :param head: end node of each edge
+  :param cap: integer capacity of each edge
+  :param sink: index of the sink, the last node
+  :return: value of the maximum flow
+  """
+  graph = csr_matrix((cap.astype(np.int32), (tail, head)), shape=(sink+1, sink+1))
+  return maximum_flow(graph, 0, sink).flow_value
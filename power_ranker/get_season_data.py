@@ -8,13 +8,15 @@ FIXME maybe want to sort by team_id for all built tables?
 import logging
 import pandas as pd
 import numpy as np
-from itertools import *
-from operator import itemgetter
+from .season_matrix import SeasonMatrix
 
 __author__ = 'Ryne Carbone'
 
 logger = logging.getLogger(__name__)
 
+# Possible matchup results in the ESPN api
+WINNERS = ['AWAY', 'HOME', 'TIE', 'UNDECIDED']
+
 
 def build_owner_table(data):
     """Create data frame with league owner information
@@ -64,194 +66,96 @@ def build_team_table(data):
 def build_schedule_table(data):
     """Build table with matchup data
 
-    Include home/away, scores, result, matchup period ids
+    Include home/away, scores, result, matchup period ids. Columns are built
+    in one pass over the matchups: ids are int16, points stay float64 so
+    scores keep their decimals exactly, and the winner is categorical with
+    missing results counted as UNDECIDED. The points scored in the matchup period are pulled
+    out of the nested pointsByScoringPeriod dicts into a float column (NaN
+    until the game is played).
     :param data: json data from api with 'schedule' keyword
     :return: data frame with row for each matchup and summary of results
     """
-    # Define columns to select
-    schedule_cols = ['id', 'matchupPeriodId', 'home', 'away', 'winner']
-    home_away_cols = ['teamId', 'pointsByScoringPeriod', 'totalPoints']
-    # Rename columns for more clarity
-    rename_dict_away = {
-        'teamId': 'away_id',
-        'pointsByScoringPeriod': 'away_points_scoring_period',
-        'totalPoints': 'away_total_points'
-    }
-    rename_dict_home = {
-        'teamId': 'home_id',
-        'pointsByScoringPeriod': 'home_points_scoring_period',
-        'totalPoints': 'home_total_points'
-    }
-    # Plop data into a frame
-    df_schedule = pd.DataFrame(data.get('schedule'), columns=schedule_cols)
-    # Identify rows where teams are listed as nan -- looks like bye weeks
-    missing_teams = (df_schedule.away.isnull() | df_schedule.home.isnull())
-    #bye_weeks = df_schedule[missing_teams].get(['id', 'matchupPeriodId'])
-    df_schedule = df_schedule[~missing_teams].reset_index(drop=True)
-    # Extract the relevant columns from nested home/away dicts and concat
-    # Note: 'pointsByScoringPeriod' only appears after the games have been played
-    df_schedule = pd.concat([
-        (pd.DataFrame(df_schedule.away.tolist(), columns=home_away_cols).rename(rename_dict_away, axis=1)),
-        (pd.DataFrame(df_schedule.home.tolist(), columns=home_away_cols).rename(rename_dict_home, axis=1)),
-        df_schedule.drop(['away', 'home'], axis=1)
-    ], axis=1)
-    # For completed games, extract home/away pointsByScoringPeriod
-    completed_games = (df_schedule.winner != 'UNDECIDED')
-    if sum(completed_games) == 0:
+    # Matchups without a home or away team look like bye weeks
+    matchups = [m for m in data.get('schedule') if m.get('home') and m.get('away')]
+    winner = [m.get('winner') or 'UNDECIDED' for m in matchups]
+    if all(w == 'UNDECIDED' for w in winner):
         logger.warning('No games have been completed, schedule is empty.')
         raise ValueError('No games have been completed, schedule is empty.')
-    df_schedule.loc[completed_games, 'away_points_scoring_period'] = \
-        df_schedule[completed_games].apply(lambda x: x.away_points_scoring_period.get(str(x.matchupPeriodId)), axis=1)
-    df_schedule.loc[completed_games, 'home_points_scoring_period'] = \
-        df_schedule[completed_games].apply(lambda x: x.home_points_scoring_period.get(str(x.matchupPeriodId)), axis=1)
-    return df_schedule
-
-
-def build_season_summary_table(df_schedule, week):
-    """Build a summary view of season results
-
+    period = np.array([m.get('matchupPeriodId') for m in matchups], dtype=np.int16)
+    columns = {}
+    for side in ['away', 'home']:
+        teams = [m.get(side) for m in matchups]
+        columns[f'{side}_id'] = np.array([t.get('teamId') for t in teams], dtype=np.int16)
+        # Note: 'pointsByScoringPeriod' only appears after the games have been played
+        columns[f'{side}_points_scoring_period'] = np.array(
+            [(t.get('pointsByScoringPeriod') or {}).get(str(p), np.nan) for t, p in zip(teams, period)],
+            dtype=float)
+        columns[f'{side}_total_points'] = np.array([t.get('totalPoints', np.nan) for t in teams], dtype=float)
+    columns['id'] = np.array([m.get('id') for m in matchups], dtype=np.int32)
+    columns['matchupPeriodId'] = period
+    columns['winner'] = pd.Categorical(winner, categories=sorted(set(WINNERS).union(winner)))
+    return pd.DataFrame(columns)
+
+
+def build_team_game_table(df_schedule):
+    """Build long table with one row per team for every decided game
+
+    Each matchup appears twice, once from each team's side, so per-team
+    stats are a lookup on the sorted index instead of a query over the
+    whole schedule
     :param df_schedule: schedule table with all matchup data
-    :param week: matchup id of current week
+    :return: data frame indexed by team_id and week, with opp_id, points,
+      opp_points, result ('W', 'L' or 'T') and home columns
     """
-    away_sum = (
-        df_schedule
-        .query(f'matchupPeriodId <= {week} & winner!="UNDECIDED"')
-        .groupby('away_id')
-        .agg(away_wins=('winner', lambda x: sum(x == 'AWAY')),
-             away_games=('matchupPeriodId', 'size'),
-             away_points_for=('away_total_points', 'sum'),
-             away_points_against=('home_total_points', 'sum'))
-        .reset_index()
-        .rename({'away_id': 'team_id'}, axis=1)
-    )
-    home_sum = (
-        df_schedule
-        .query(f'matchupPeriodId <= {week} & winner!="UNDECIDED"')
-        .groupby('home_id')
-        .agg(home_wins=('winner', lambda x: sum(x == 'HOME')),
-             home_games=('matchupPeriodId', 'size'),
-             home_points_for=('home_total_points', 'sum'),
-             home_points_against=('away_total_points', 'sum'))
-        .reset_index()
-        .rename({'home_id': 'team_id'}, axis=1)
-    )
-    df_sum = pd.merge(home_sum, away_sum, on='team_id', how='outer').fillna(0)
-    if df_sum.empty:
-        logger.info('No games have been logged yet')
-        raise ValueError('No games have been logged yet')
-    df_sum['wins'] = df_sum.apply(lambda x: x.get('home_wins') + x.get('away_wins'), axis=1)
-    df_sum['games'] = df_sum.apply(lambda x: x.get('home_games') + x.get('away_games'), axis=1)
-    df_sum['points_for'] = df_sum.apply(lambda x: x.get('home_points_for') + x.get('away_points_for'), axis=1)
-    df_sum['points_against'] = df_sum.apply(
-        lambda x: x.get('home_points_against') + x.get('away_points_against'), axis=1
-    )
-    # Add max/min scores
-    df_sum['max_score'] = df_sum.apply(
-        lambda x: get_team_scores(df_schedule=df_schedule, team=x.get('team_id'), week=week).max(), axis=1
-    )
-    df_sum['min_score'] = df_sum.apply(
-        lambda x: get_team_scores(df_schedule=df_schedule, team=x.get('team_id'), week=week).min(), axis=1
-    )
-    # Add streak
-    df_sum['streak'] = df_sum.apply(lambda x: calc_streak(df_schedule, x.get('team_id'), week), axis=1)
-    # Add overall ESPN ranking
-    df_sum['overall'] = (
-        df_sum[['wins', 'points_for']]
-        .apply(tuple, axis=1)
-        .rank(method='dense', ascending=False)
-        .astype(int)
-        .reset_index(drop=True)
-    )
-    # Add aggregate wins to the season summary
-    agg_wins = calc_agg_wins(df_schedule, week)
-    df_sum = pd.merge(df_sum, agg_wins, on='team_id')
-    return df_sum
-
-
-def calc_agg_wins(df_schedule, week):
-    """Calculate aggregate wins and games played
-
-    :param df_schedule: schedule table with all matchup data
-    :param week: matchup id of current week
-    :return: data frame with aggregate wins, games played, and wpct
+    df_played = df_schedule[df_schedule.winner != 'UNDECIDED']
+    winner = np.asarray(df_played.winner)
+    sides = []
+    for side, opp, won, lost in [('home', 'away', 'HOME', 'AWAY'), ('away', 'home', 'AWAY', 'HOME')]:
+        sides.append(pd.DataFrame({
+            'team_id': df_played[f'{side}_id'].values,
+            'week': df_played.matchupPeriodId.values,
+            'opp_id': df_played[f'{opp}_id'].values,
+            'points': df_played[f'{side}_total_points'].values,
+            'opp_points': df_played[f'{opp}_total_points'].values,
+            'result': np.select([winner == won, winner == lost], ['W', 'L'], 'T'),
+            'home': side == 'home'}))
+    return pd.concat(sides, ignore_index=True).set_index(['team_id', 'week']).sort_index()
+
+
+def get_team_games(df_games, team, week):
+    """Get all decided games for a team
+
+    :param df_games: team-game table from build_team_game_table
+    :param team: id for team
+    :param week: current week
+    :return: data frame of the team's games up to week, indexed by week
     """
-    # Make a row for each team for each week
-    away_games = (
-        df_schedule
-        .query(f'matchupPeriodId <= {week} & winner!="UNDECIDED"')
-        [['matchupPeriodId', 'away_id', 'away_total_points']]
-        .rename({'away_id': 'team_id', 'away_total_points': 'points'}, axis=1)
-    )
-    home_games = (
-        df_schedule
-        .query(f'matchupPeriodId <= {week} & winner!="UNDECIDED"')
-        [['matchupPeriodId', 'home_id', 'home_total_points']]
-        .rename({'home_id': 'team_id', 'home_total_points': 'points'}, axis=1)
-    )
-    # Combine all rows
-    all_games = pd.concat([away_games, home_games], axis=0)
-    # Rank each team by points scored each week to calculate 'aggregate' wins
-    all_games['agg_wins'] = all_games.groupby('matchupPeriodId').points.rank(ascending=True) - 1
-    # Summarise wins over the season
-    agg_wins = (
-        all_games
-        .sort_values(['matchupPeriodId', 'points'])
-        .groupby('team_id')
-        .agg(agg_wins=('agg_wins', 'sum'))
-        .reset_index()
-    )
-    # Count total games
-    agg_wins['agg_games'] = all_games.matchupPeriodId.size - all_games.matchupPeriodId.unique().size
-    # Calculate winning percentage
-    agg_wins['agg_wpct'] = agg_wins['agg_wins'] / agg_wins['agg_games']
-    return agg_wins
+    if team not in df_games.index.get_level_values('team_id'):
+        # Teams without a decided game have no rows in the table
+        return df_games.iloc[:0].reset_index('team_id', drop=True)
+    return df_games.loc[team].loc[:week]
 
 
-def calc_streak(df_schedule, team, week):
-    """Calculate current winning/losing streak
+def get_team_scores(df_games, team, week):
+    """Get all scores for a team
 
-    :param df_schedule: data frame with scores and team id for each game
-    :param team: team id
+    :param df_games: team-game table from build_team_game_table
+    :param team: id for team
     :param week: current week
-    :return: returns current streak for team
+    :return: series of scores for team up to week
     """
-    l_mov = (
-        df_schedule
-        .query(f'(home_id=={team} | away_id=={team}) & (matchupPeriodId <= {week} & winner != "UNDECIDED")')
-        .sort_values('matchupPeriodId')
-        .apply(lambda x:
-               x.home_total_points - x.away_total_points if x.home_id == team else
-               x.away_total_points - x.home_total_points, axis=1).values
-    )
-    # Break up MOV list into consecutive streaks (i.e. same sign)
-    l_streaks = get_streaks(l_mov=l_mov)
-    # Grab most recent streak, return length (and sign)
-    current_streak = l_streaks[-1]
-    return len(current_streak)*np.sign(current_streak[0])
+    return get_team_games(df_games=df_games, team=team, week=week).points
 
 
-def get_streaks(l_mov):
-    """Break up list of MOV into streaks
+def build_season_summary_table(df_schedule, week, df_games=None):
+    """Build a summary view of season results
 
-    Algorithm from: https://stackoverflow.com/questions/38708692/identify-if-list-has-consecutive-elements-that-are-equal-in-python
-    :param l_mov: list of margin of victory
-    :return: list of streaks
+    Read from the running totals of the season's SeasonMatrix
+    :param df_schedule: schedule table with all matchup data
+    :param week: matchup id of current week
+    :param df_games: team-game table, built from df_schedule if missing
+    :return: data frame with a row for each team, sorted by team id
     """
-    return [list(map(itemgetter(1), g))
-            for k, g
-            in groupby(enumerate(l_mov), lambda x: np.sign(x[1]))]
-
-
-def get_team_scores(df_schedule, team, week):
-  """Get all scores for a team
-
-  :param df_schedule: data frame with scores and team ids for each game
-  :param team: id for team
-  :param week: current week
-  :return: series of scores for team up to week
-  """
-  return (
-    df_schedule
-    .query(f'(home_id=={team} | away_id=={team}) & (matchupPeriodId <= {week} & winner != "UNDECIDED")')
-    .apply(lambda x: x.home_total_points if x.home_id == team else x.away_total_points, axis=1)
-  )
+    if df_games is None:
+        df_games = build_team_game_table(df_schedule)
+    return SeasonMatrix.from_team_games(df_games, week=week).summary()
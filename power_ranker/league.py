@@ -8,17 +8,16 @@ import pandas as pd
 from .get_season_data import(
   build_team_table,
   build_schedule_table,
-  build_season_summary_table
+  build_team_game_table
 )
 from .settings import Settings
 from .two_step_dom import get_two_step_dom_ranks
 from .lsq import get_ranks_lsq
 from .colley import get_colley_ranks
 from .utils import (
-  calc_sos,
-  calc_luck,
-  calc_cons,
+  calc_remaining_sos,
   calc_power,
+  calc_power_sweep,
   save_ranks,
   calc_tiers,
   fetch_page)
@@ -26,6 +25,8 @@ from .web.radar import save_team_radar_plots
 from .web.website import generate_web
 from .web.power_plot import make_power_plot, save_team_weekly_ranking_plots
 from .playoff_odds import calc_playoffs
+from .score_models import fit_score_model
+from .season_matrix import SeasonMatrix
 
 __author__ = 'Ryne Carbone'
 
@@ -98,9 +99,19 @@ class League:
     """Scrape data for season"""
     self.df_teams = build_team_table(data)
     self.df_schedule = build_schedule_table(data)
-    self.df_season_summary = build_season_summary_table(df_schedule=self.df_schedule, week=self.week)
+    self.df_games = build_team_game_table(self.df_schedule)
+    self.season = SeasonMatrix.from_team_games(self.df_games)
+    self.df_season_summary = self.stats_as_of(self.week)
     self.df_ranks = self.df_season_summary[['team_id', 'overall']].reset_index(drop=True)
 
+  def stats_as_of(self, week):
+    """Season summary as of the end of a week, read from the season's running totals
+
+    :param week: matchup period to summarize through
+    :return: data frame with the season summary for each team
+    """
+    return self.season.summary(week)
+
   def _scrape_settings(self, data):
     """Scrape league settings info"""
     self.settings = Settings(data)
@@ -114,14 +125,16 @@ class League:
       .reset_index(drop=True)
     )
 
-  def _calc_lsq(self, B_w=30., B_r=35., dS_max=35., beta_w=2.2, show_plot=False):
+  def _calc_lsq(self, B_w=30., B_r=35., dS_max=35., beta_w=2.2, show_plot=False,
+                save_plot=True, tol=1e-4, max_iter=100):
     """Calculate rankings based on iterative lsq method"""
     lsq = get_ranks_lsq(
       df_teams=self.df_teams,
       df_schedule=self.df_schedule,
       year=self.year,
       week=self.week,
-      B_w=B_w, B_r=B_r, dS_max=dS_max, beta_w=beta_w, show=show_plot
+      B_w=B_w, B_r=B_r, dS_max=dS_max, beta_w=beta_w, show=show_plot,
+      save_plot=save_plot, tol=tol, max_iter=max_iter
     )
     self.df_ranks = (
       pd.merge(self.df_ranks, lsq, on='team_id', how='left')
@@ -140,21 +153,40 @@ class League:
 
   def _calc_sos(self, rank_power=2.37):
     """Calculates the strength of schedule based on the lsq rankings"""
-    self.df_ranks = calc_sos(
+    season = self.season.until(self.week)
+    lsq = season.align(self.df_ranks.lsq.values, self.df_ranks.team_id.values)
+    sos = season.frame(sos=season.sos(lsq, rank_power=rank_power))
+    self.df_ranks = (
+      pd.merge(self.df_ranks, sos, on='team_id', how='left')
+      .sort_values('team_id')
+      .reset_index(drop=True)
+    )
+
+  def _calc_win_probs(self, score_model='normal'):
+    """Calculates the chance each team beats each other team, and the remaining strength of schedule"""
+    model = fit_score_model(
+      df_schedule=self.df_schedule,
+      team_ids=self.df_teams.team_id.values,
+      week=self.week,
+      model=score_model
+    )
+    self.df_win_probs = pd.DataFrame(
+      model.win_prob_matrix(),
+      index=self.df_teams.team_id.values,
+      columns=self.df_teams.team_id.values
+    )
+    self.df_ranks = calc_remaining_sos(
       df_schedule=self.df_schedule,
       df_ranks=self.df_ranks,
+      df_win_probs=self.df_win_probs,
       week=self.week,
-      rank_power=rank_power
+      reg_season=self.settings.reg_season_count
     )
 
   def _calc_luck(self, awp_weight=0.5):
     """Calculates the luck index"""
-    luck = calc_luck(
-      df_schedule=self.df_schedule,
-      df_season_summary=self.df_season_summary,
-      week=self.week,
-      awp_weight=awp_weight
-    )
+    season = self.season.until(self.week)
+    luck = season.frame(luck=season.luck(awp_weight=awp_weight))
     self.df_ranks = (
       pd.merge(self.df_ranks, luck, on='team_id', how='left')
       .sort_values('team_id')
@@ -163,7 +195,13 @@ class League:
 
   def _calc_cons(self):
     """Calculate the consistency index"""
-    self.df_ranks = calc_cons(self.df_ranks, self.df_schedule, self.week)
+    season = self.season.until(self.week)
+    cons = season.frame(cons=season.cons())
+    self.df_ranks = (
+      pd.merge(self.df_ranks, cons, on='team_id', how='left')
+      .sort_values('team_id')
+      .reset_index(drop=True)
+    )
 
   def _calc_power(self, w_dom=0.18, w_lsq=0.18, w_col=0.18, w_awp=0.18,
                   w_sos=0.06, w_luck=0.06, w_cons=0.10, w_strk=0.06):
@@ -181,6 +219,19 @@ class League:
       w_strk=w_strk
     )
 
+  def sweep_power_weights(self, weights):
+    """Power ranks for a batch of [Power] weight vectors. Must run get_power_rankings() first
+
+    :param weights: array with shape (n_weights, 8), columns ordered as
+      w_dom, w_lsq, w_col, w_awp, w_sos, w_luck, w_cons, w_strk
+    :return: data frame of power ranks, a row for each weight vector and a column for each team id
+    """
+    return calc_power_sweep(
+      df_ranks=self.df_ranks,
+      df_season_summary=self.df_season_summary,
+      weights=weights
+    )
+
   def _calc_tiers(self, bw=0.09, order=4, show_plot=False):
     """Calculates tiers based on the power rankings"""
     self.df_ranks = calc_tiers(
@@ -239,7 +290,7 @@ class League:
     df_out['overall'] = df_out.apply(lambda x: f'{x.get("d_overall")}{x.get("overall"):2}', axis=1)
     df_out['tier'] = df_out.apply(lambda x: f'{x.get("d_tier")}{x.get("tier")}', axis=1)
     print(df_out[['Team', 'rec', '#', 'power', 'lsq', 'col', 'dom', 'awp',
-                  'sos', 'luck', 'cons', 'tier', 'PF', 'PA', 'overall']].to_string(index=False))
+                  'sos', 'rsos', 'luck', 'cons', 'tier', 'PF', 'PA', 'overall']].to_string(index=False))
 
   def get_power_rankings(self):
     """
@@ -260,12 +311,17 @@ class League:
       B_r       = self.config['LSQ'].getfloat('B_r', 35.),
       dS_max    = self.config['LSQ'].getfloat('dS_max', 35.),
       beta_w    = self.config['LSQ'].getfloat('beta_w', 2.2),
-      show_plot = self.config['LSQ'].getboolean('show_plot', False)
+      show_plot = self.config['LSQ'].getboolean('show_plot', False),
+      save_plot = self.config['LSQ'].getboolean('save_plot', True),
+      tol       = self.config['LSQ'].getfloat('tol', 1e-4),
+      max_iter  = self.config['LSQ'].getint('max_iter', 100)
     )
     # Calculate Colley rankings
     self._calc_colley(printMatrix = self.config['Colley'].getboolean('printMatrix', False))
     # Calculate SOS
     self._calc_sos(rank_power = self.config['SOS'].getfloat('rank_power', 2.37))
+    # Calculate head-to-head win probabilities and remaining SOS
+    self._calc_win_probs(score_model = self.config.get('Playoffs', 'score_model', fallback='normal'))
     # Calculate Luck index
     self._calc_luck(awp_weight = self.config['Luck'].getfloat('awp_weight', 0.5))
     # Calculate the Consistency index
@@ -292,7 +348,7 @@ class League:
     # Print Sorted team
     self.print_rankings()
     # Calc the playoff odds
-    do_playoffs = self.config['Playoffs'].getboolean('doPlayoffs', False)
+    do_playoffs = self.config.getboolean('Playoffs', 'doPlayoffs', fallback=False)
     if do_playoffs:
       calc_playoffs(
         df_teams=self.df_teams,
@@ -301,7 +357,21 @@ class League:
         year=self.year,
         week=self.week,
         settings=self.settings,
-        n_sims = self.config['Playoffs'].getint('num_simulations', 200000)
+        n_sims = self.config['Playoffs'].getint('num_simulations', 200000),
+        chunk_size = self.config['Playoffs'].getint('chunk_size', 10000),
+        n_workers = self.config['Playoffs'].getint('n_workers', 1),
+        seed = self.config['Playoffs'].getint('seed', None),
+        n_checkpoints = self.config['Playoffs'].getint('n_checkpoints', 100),
+        log_checkpoints = self.config['Playoffs'].getboolean('log_checkpoints', False),
+        adaptive = self.config['Playoffs'].getboolean('adaptive', False),
+        target_se = self.config['Playoffs'].getfloat('target_se', 0.005),
+        max_sims = self.config['Playoffs'].getint('max_simulations', 1000000),
+        exact_games = self.config['Playoffs'].getint('exact_games', -1),
+        variance_reduction = self.config['Playoffs'].get('variance_reduction', 'none'),
+        compare_variance = self.config['Playoffs'].getboolean('compare_variance', False),
+        cache = self.config['Playoffs'].getboolean('cache', False),
+        backfill = self.config['Playoffs'].getboolean('backfill', False),
+        score_model = self.config['Playoffs'].get('score_model', 'normal')
       )
 
   def make_website(self):
@@ -325,13 +395,15 @@ class League:
       df_schedule=self.df_schedule,
       df_teams=self.df_teams,
       year=self.year,
-      week=self.week)
+      week=self.week,
+      score_model=self.config.get('Playoffs', 'score_model', fallback='normal'))
     # Generate html files for team and summary pages
     generate_web(
       df_teams=self.df_teams,
       df_ranks=self.df_ranks,
       df_season_summary=self.df_season_summary,
       df_schedule=self.df_schedule,
+      df_games=self.df_games,
       year=self.year,
       week=self.week,
       league_id=self.league_id,
@@ -340,6 +412,7 @@ class League:
       endpoint_history=self.endpoint_history,
       params=self.params,
       cookies=self.cookies,
+      df_win_probs=self.df_win_probs,
       doSetup=doSetup
     )
 
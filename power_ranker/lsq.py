@@ -10,7 +10,7 @@ Notation is used from the following paper:
 from pathlib import Path
 import logging
 from scipy.optimize import lsq_linear
-from scipy.sparse import coo_matrix
+from scipy.sparse import csr_matrix
 import numpy as np
 import pandas as pd
 from plotnine import ggplot, aes, geom_line, geom_label, theme_bw, labs, guides
@@ -60,60 +60,84 @@ def calc_r_g(df_scores, dS_max=35., B_w=30., B_r=35.):
   return df_scores.get('R_g')
 
 
-def calc_sig_g(N_g, df_ranks, beta_w):
+def get_game_teams(df_teams, N_g):
+  """Position of the home and away team of each game among the teams
+
+  :param df_teams: data frame with team ids
+  :param N_g: data frame with rows for each game and home/away ids
+  :return: integer arrays of home and away team positions in df_teams
+  """
+  team_pos = pd.Index(df_teams.team_id.values)
+  return team_pos.get_indexer(N_g.home_id.values), team_pos.get_indexer(N_g.away_id.values)
+
+
+def build_game_matrix(home_idx, away_idx, n_teams):
+  """Build the sparse matrix of games, +1 for the home team and -1 for the away team
+
+  Each row holds the two entries of one game, with sorted column indices so
+  the entries of game g stay at data[2g] and data[2g+1]
+  :param home_idx: home team position for each game
+  :param away_idx: away team position for each game
+  :param n_teams: number of teams
+  :return: CSR matrix with shape (n_games, n_teams)
+  """
+  n_games = home_idx.size
+  home_first = home_idx < away_idx
+  indices = np.column_stack([np.minimum(home_idx, away_idx), np.maximum(home_idx, away_idx)]).ravel()
+  data = np.column_stack([np.where(home_first, 1., -1.), np.where(home_first, -1., 1.)]).ravel()
+  return csr_matrix((data, indices, np.arange(0, 2*n_games+1, 2)), shape=(n_games, n_teams))
+
+
+def calc_sig_g(home_idx, away_idx, ranks, beta_w):
   """Calculate sigma for each game
 
-  :param N_g: data frame with record of home/away teams
-  :param df_ranks: data frame with the previous ranks for each team
+  :param home_idx: home team position for each game
+  :param away_idx: away team position for each game
+  :param ranks: previous ranks for each team
   :param beta_w: controls weighting of alpha_w
   :return: sigma for each game
   """
-  alpha_w = (df_ranks.get('ranks').max(axis=0) - df_ranks.get('ranks').min(axis=0)) / np.log(beta_w * beta_w)
-  N_g['home_rank'] = N_g.get('home_id').apply(lambda x: df_ranks.loc[df_ranks.team_id == x, 'ranks'].values[0])
-  N_g['away_rank'] = N_g.get('away_id').apply(lambda x: df_ranks.loc[df_ranks.team_id == x, 'ranks'].values[0])
-  w_g = np.exp(-np.fabs(N_g.get('home_rank') - N_g.get('away_rank')) / alpha_w)
+  alpha_w = (ranks.max() - ranks.min()) / np.log(beta_w * beta_w)
+  w_g = np.exp(-np.fabs(ranks[home_idx] - ranks[away_idx]) / alpha_w)
   sig_g = 1 / np.sqrt(w_g)
   return sig_g
 
 
-def calc_ranks_lsq_iter(df_teams, N_g, R_g, prev_ranks=None, beta_w=2.2, initial_pass=False):
+def calc_ranks_lsq_iter(A, R_g, home_idx, away_idx, prev_ranks=None, beta_w=2.2):
   """Calculates new rankings based on previous rankings using linear lsq algorithm
 
-  :param df_teams: data frame with team ids
-  :param N_g: data frame with rows for each game and home/away ids
+  The entries of A are rescaled in place to +/- 1/sig_g for the home/away
+  team of each game, so its structure is built once for all iterations
+  :param A: game matrix from build_game_matrix
   :param R_g: game results based on score differential
-  :param prev_ranks: data frame with previous iteration rankings for each team
+  :param home_idx: home team position for each game
+  :param away_idx: away team position for each game
+  :param prev_ranks: previous iteration rankings for each team, None for the first iteration
   :param beta_w: control weighting of alpha_w
-  :param initial_pass: flag to indicate first iteration of algorithm
-  :return: list of new rankings
+  :return: array of new rankings for each team
   """
-  if initial_pass:
-    sig_g = np.ones(N_g.index.size)
+  if prev_ranks is None:
+    sig_g = np.ones(home_idx.size)
   else:
-    sig_g = calc_sig_g(N_g=N_g, df_ranks=prev_ranks, beta_w=beta_w)
+    sig_g = calc_sig_g(home_idx=home_idx, away_idx=away_idx, ranks=prev_ranks, beta_w=beta_w)
   # Calculate the coefficient vector
   b = R_g/sig_g
-  # Get dimensions for matrix
-  max_id = max(N_g.get('away_id').max(),
-               N_g.get('home_id').max())
-  n_games = N_g.get('home_id').size
-  # Calculate the matrix using COO formatted matrix (n_games x n_teams dimensions)
-  # Elements are +/- 1/sig_g if team is home/away else 0
-  home_coo = coo_matrix((1/sig_g, (N_g.home_id.index, N_g.home_id.values)), shape=(n_games, max_id+1))
-  away_coo = coo_matrix((-1/sig_g, (N_g.away_id.index, N_g.away_id.values)), shape=(n_games, max_id+1))
-  A = home_coo + away_coo
+  # Elements are +/- 1/sig_g if team is home/away, keeping the sign of each entry
+  np.copysign(np.repeat(1/sig_g, 2), A.data, out=A.data)
   # Solve for the rankings
   res = lsq_linear(A=A, b=b, bounds=(30, 130))
   if res.success == False:
     logger.warning(f'WARNING: {res.message}')
-  # Match the rankings to the teams and return a data frame
-  new_ranks = pd.DataFrame(dict(team_id=df_teams.team_id, ranks = res.x[df_teams.team_id.values]))
-  return new_ranks
+  return res.x
 
 
-def get_ranks_lsq(df_teams, df_schedule, year, week, B_w=30., B_r=35., dS_max=35., beta_w=2.2, show=False):
+def get_ranks_lsq(df_teams, df_schedule, year, week, B_w=30., B_r=35., dS_max=35., beta_w=2.2, show=False,
+                  save_plot=True, tol=1e-4, max_iter=100):
   """Calculate iterative LSQ rankings, and save plot
 
+  The final rank averages the last 30% of the iterations (iterations 71-99
+  of 100). Iterating stops early once no rank in that window changes by
+  more than tol from one iteration to the next.
   :param df_teams: data frame wtih team_ids
   :param df_schedule: data frame with data for each matchup
   :param year: current year
@@ -123,62 +147,88 @@ def get_ranks_lsq(df_teams, df_schedule, year, week, B_w=30., B_r=35., dS_max=35
   :param dS_max: max home mov for truncation
   :param beta_w: for measuring alpha_w
   :param show: flag for showing plot
+  :param save_plot: flag for saving the plot of the iterations
+  :param tol: largest rank change within the averaging window to stop at, 0 to always run max_iter
+  :param max_iter: maximum number of iterations
   :return: data frame with team_id and rankings
   """
-  logger.debug('Calculating ranks using LSQ method with 100 iterations')
+  logger.debug(f'Calculating ranks using LSQ method with up to {max_iter} iterations')
   N_g = calc_n_g(df_schedule, week)
-  R_g = calc_r_g(N_g, dS_max=dS_max, B_w=B_w, B_r=B_r)
-  df_ranks = calc_ranks_lsq_iter(
-    df_teams=df_teams,
-    N_g=N_g,
-    R_g=R_g,
-    prev_ranks=None,
-    beta_w=beta_w,
-    initial_pass=True
-  )
-  prev_ranks = df_ranks
+  R_g = calc_r_g(N_g, dS_max=dS_max, B_w=B_w, B_r=B_r).values
+  home_idx, away_idx = get_game_teams(df_teams, N_g)
+  A = build_game_matrix(home_idx, away_idx, df_teams.team_id.size)
+  prev_ranks = calc_ranks_lsq_iter(A=A, R_g=R_g, home_idx=home_idx, away_idx=away_idx, beta_w=beta_w)
+  # Ranks of each team (columns) at each iteration (rows)
+  history = np.empty((max_iter, df_teams.team_id.size))
+  history[0] = prev_ranks
+  n_iter = 1
   # Iterate with previous ranks as input, recalculate weight
-  for p in range(1, 100):
+  for p in range(1, max_iter):
     prev_ranks = calc_ranks_lsq_iter(
-      df_teams=df_teams,
-      N_g=N_g,
+      A=A,
       R_g=R_g,
+      home_idx=home_idx,
+      away_idx=away_idx,
       prev_ranks=prev_ranks,
-      beta_w=beta_w,
-      initial_pass=False
+      beta_w=beta_w
     )
-    df_ranks = pd.concat([df_ranks, prev_ranks.ranks.rename(p)], axis=1)
-  # plot_save_ranks
-  df_final_ranks = plot_save_rank(
-    df_ranks=df_ranks,
-    df_teams=df_teams,
-    year=year,
-    week=week,
-    show=show
-  )
+    history[p] = prev_ranks
+    n_iter = p + 1
+    # Stop once every step in the averaging window is within tolerance
+    window_start = get_window_start(n_iter)
+    if n_iter - window_start >= 3 and np.abs(np.diff(history[window_start-1:n_iter], axis=0)).max() < tol:
+      logger.debug(f'LSQ ranks converged after {n_iter} iterations')
+      break
+  history = history[:n_iter]
+  if show or save_plot:
+    plot_save_rank(
+      history=history,
+      df_teams=df_teams,
+      year=year,
+      week=week,
+      show=show,
+      save_plot=save_plot
+    )
+  # Average the window to get final rank
+  df_final_ranks = pd.DataFrame({
+    'team_id': df_teams.team_id.values,
+    'lsq': np.tanh(history[get_window_start(n_iter):].mean(axis=0) / 75.)
+  }).sort_values('team_id').reset_index(drop=True)
+  # Normalize by max score
+  df_final_ranks['lsq'] = df_final_ranks.get('lsq') / df_final_ranks.get('lsq').max()
   return df_final_ranks
 
 
-def plot_save_rank(df_ranks, df_teams, year, week, show=False):
+def get_window_start(n_iter):
+  """First iteration averaged into the final rank, leaving the last 30% of iterations
+
+  :param n_iter: number of iterations run
+  :return: index of the first averaged iteration
+  """
+  return int(0.7 * n_iter) + 1
+
+
+def plot_save_rank(history, df_teams, year, week, show=False, save_plot=True):
   """Plot the ranking iterations for each team
 
-  :param df_ranks: data frame with team_id, and rankings for each iteration
+  :param history: array of ranks with a row for each iteration and a column for each team in df_teams
   :param df_teams: data frame with team_id and owner info
   :param year: year for data
   :param week: current week
   :param show: flag to display the plot
-  :return: final summarised rankings data frame with columns for team_id and ranks
+  :param save_plot: flag to save the plot to output/{year}/week{week}
+  :return: None
   """
+  last_iter = history.shape[0] - 1
   # Plot each iteration
-  df_ranks_lsq = pd.merge(df_teams[['team_id', 'firstName']], df_ranks, on='team_id')
+  df_ranks_lsq = pd.concat([
+    df_teams[['team_id', 'firstName']].reset_index(drop=True),
+    pd.DataFrame(history.T)
+  ], axis=1)
   # Space out labels on x-axis according to final rankings
-  df_ranks_lsq['label_x_pos'] = df_ranks_lsq.get(99).rank() * 100 / df_ranks_lsq.get(99).size
+  df_ranks_lsq['label_x_pos'] = df_ranks_lsq.get(last_iter).rank() * last_iter / df_ranks_lsq.get(last_iter).size
   # Convert to long format for plotting ease
-  df_ranks_lsq_long = (
-    df_ranks_lsq
-    .rename({'ranks': '0'}, axis='columns')
-    .melt(id_vars=['team_id', 'firstName', 'label_x_pos'])
-  )
+  df_ranks_lsq_long = df_ranks_lsq.melt(id_vars=['team_id', 'firstName', 'label_x_pos'])
   # Convert iteration variable to int
   df_ranks_lsq_long.variable = df_ranks_lsq_long.variable.astype(int)
   # Make the plot
@@ -187,35 +237,22 @@ def plot_save_rank(df_ranks, df_teams, year, week, show=False):
            data=df_ranks_lsq_long) +
     geom_line() +
     geom_label(aes(label='firstName', x='label_x_pos', y='value', color='factor(team_id)'),
-               data=df_ranks_lsq_long[df_ranks_lsq_long.variable == 99],
+               data=df_ranks_lsq_long[df_ranks_lsq_long.variable == last_iter],
                size=10) +
     labs(x='Iteration', y='LSQ rank') +
     theme_bw() +
     guides(color=False)
   )
-  # Save plot
   if show:
     p.draw()
-  # make dir if it doesn't exist already
-  out_dir = Path(f'output/{year}/week{week}')
-  out_dir.mkdir(parents=True, exist_ok=True)
-  out_name = out_dir / 'lsq_iter_rankings.png'
-  # plotnine is throwing too many warnings
-  warnings.filterwarnings('ignore')
-  p.save(out_name, width=9, height=6, dpi=300)
-  warnings.filterwarnings('default')
-  logger.info(f'Saved LSQ rankings plot to local file: {out_name.resolve()}')
-  # Average last 70 elements to get final rank
-  df_final_ranks = (
-    df_ranks_lsq_long
-    .query('variable>70')
-    .groupby(['team_id'])[['value']]
-    .agg(lambda x: np.tanh(np.mean(x) / 75.))
-    .reset_index()
-    .rename({'value': 'lsq'}, axis=1)
-  )
-  # Normalize by max score
-  df_final_ranks['lsq'] = df_final_ranks.get('lsq') / df_final_ranks.get('lsq').max()
-  return df_final_ranks
-
-
+  # Save plot
+  if save_plot:
+    # make dir if it doesn't exist already
+    out_dir = Path(f'output/{year}/week{week}')
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_name = out_dir / 'lsq_iter_rankings.png'
+    # plotnine is throwing too many warnings
+    warnings.filterwarnings('ignore')
+    p.save(out_name, width=9, height=6, dpi=300)
+    warnings.filterwarnings('default')
+    logger.info(f'Saved LSQ rankings plot to local file: {out_name.resolve()}')
@@ -2,21 +2,39 @@
 
 """Simulate the rest of season to calculate playoff odds"""
 
+import time
 import logging
 import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pandas as pd
 import numpy as np
 from scipy.stats import norm
+from scipy.special import ndtr, ndtri
+try:
+  from scipy.stats import qmc
+except ImportError:  # scipy < 1.7
+  qmc = None
 from plotnine import *
-from .get_season_data import get_team_scores
+from .score_models import fit_score_model
+from .clinch import calc_clinch_status
+from .sim_store import get_store_key, load_store, create_store, save_store
 
 __author__ = 'Ryne Carbone'
 
 logger = logging.getLogger(__name__)
 
+VARIANCE_REDUCTION_METHODS = ('none', 'antithetic', 'qmc')
+# Enumeration holds 2^n_games * n_tiebreak_draws rows, so cap the games enumerated
+MAX_EXACT_GAMES = 16
 
-def calc_playoffs(df_teams, df_sum, df_schedule, year, week, settings, n_sims=200000):
+
+def calc_playoffs(df_teams, df_sum, df_schedule, year, week, settings, n_sims=200000,
+                  chunk_size=10000, n_workers=1, seed=None,
+                  n_checkpoints=100, log_checkpoints=False, adaptive=False, target_se=0.005,
+                  max_sims=1000000, exact_games=-1, variance_reduction='none', compare_variance=False,
+                  cache=False, backfill=False, score_model='normal'):
   """Calculates playoff odds for each team using MC simulations
   
   :param df_teams: has scores and schedule for each team in league
@@ -26,6 +44,20 @@ def calc_playoffs(df_teams, df_sum, df_schedule, year, week, settings, n_sims=20
   :param week: current week, needed to simulate rest of season
   :param settings: has settings for regular season, playoffs, divisions
   :param n_sims: number of simulations to run
+  :param chunk_size: number of simulations per chunk
+  :param n_workers: number of processes to split the simulations across
+  :param seed: seed for the simulations, results are reproducible for a given seed
+  :param n_checkpoints: number of points on the convergence plots
+  :param log_checkpoints: flag to space the convergence checkpoints logarithmically
+  :param adaptive: flag to simulate chunks until the odds reach the target standard error
+  :param target_se: largest standard error allowed on any probability in adaptive mode
+  :param max_sims: cap on the number of simulations in adaptive mode
+  :param exact_games: enumerate every outcome instead of simulating when at most this many games remain
+  :param variance_reduction: how to draw the simulated scores, one of 'none', 'antithetic' or 'qmc'
+  :param compare_variance: flag to print the effective sample size of each variance reduction method
+  :param cache: flag to save simulations under output/{year}, and reuse them when the seed and inputs match
+  :param backfill: flag to also calculate and plot the playoff odds as of every week so far
+  :param score_model: model of weekly scores, one of 'normal', 'student_t', 'shrinkage' or 'bootstrap'
   """
   logger.info('Calculating playoff odds')
   # Retrieve settings to determine playoff format
@@ -33,30 +65,43 @@ def calc_playoffs(df_teams, df_sum, df_schedule, year, week, settings, n_sims=20
   spots      = settings.playoff_team_count
   divisions  = pd.DataFrame(settings.divisions).rename({'id': 'divisionId', 'name': 'division'}, axis=1)
   n_wc = spots - len(divisions)
+  period_length = settings.playoff_period_length or 1
   # Add in wins/points for to teams frame
   teams = pd.merge(
     df_teams,
     df_sum[['team_id', 'wins', 'points_for', 'points_against']], on='team_id'
   ).reset_index(drop=True)
-  # Fit Gaussian to team scores
-  teams['score_fit'] = teams.apply(
-    lambda x: norm.fit(get_team_scores(df_schedule=df_schedule, team=x.get('team_id'), week=week)), axis=1
-  ).reset_index(drop=True)
+  # Fit the score model, and keep each team's mean and standard deviation
+  model = fit_score_model(df_schedule=df_schedule, team_ids=teams.team_id.values, week=week, model=score_model)
+  teams['score_fit'] = model.params
   # Run simulations for the remaining games to calculate playoff odds
-  df_sim_results = run_simulation(
+  df_sim_results, df_seeds, df_what_if, n_run = run_simulation(
     teams=teams,
     schedule=df_schedule,
     week=week,
     reg_season=reg_season,
     n_sims=n_sims,
     n_wc=n_wc,
-    year=year
+    year=year,
+    chunk_size=chunk_size,
+    n_workers=n_workers,
+    seed=seed,
+    n_checkpoints=n_checkpoints,
+    log_checkpoints=log_checkpoints,
+    adaptive=adaptive,
+    target_se=target_se,
+    max_sims=max_sims,
+    exact_games=exact_games,
+    variance_reduction=variance_reduction,
+    period_length=period_length,
+    cache=cache,
+    score_model=model
   )
   # Calculate the current standings
-  calc_standings(teams=teams, divisions=divisions, spots=spots, week=week, reg_season=reg_season)
+  calc_standings(teams=teams, schedule=df_schedule, divisions=divisions, spots=spots, week=week, reg_season=reg_season)
   # Calculate the expected number of wins for each team
   logger.info('Calculating expected number of wins for remaining games')
-  exp_wins = calc_exp_wins(teams, df_schedule, week, reg_season)
+  exp_wins, win_dist = calc_exp_wins(teams, df_schedule, week, reg_season, win_probs=model.win_prob_matrix())
   # Print out the results of the simulations
   df_sim_results['playoff_pct'] = df_sim_results['wc_pct'] + df_sim_results['div_pct']
   df_sim_results = (
@@ -70,18 +115,98 @@ def calc_playoffs(df_teams, df_sum, df_schedule, year, week, settings, n_sims=20
              'div_pct': 'Div. Winner (%)',
              'playoff_pct': 'Make Playoffs (%)'}, axis=1)
   )
-  logger.info(f'Playoff simulation results (n_sim={n_sims})')
+  if n_run is None:
+    logger.info('Playoff odds from enumeration of the remaining games')
+  else:
+    logger.info(f'Playoff simulation results (n_sim={n_run})')
   pd.set_option('precision', 3)
   pd.set_option('max_columns', 20)
   pd.set_option('display.expand_frame_repr', False)
   print(df_sim_results[['firstName', 'lastName', 'Exp. Wins', 'Wildcard (%)',
                         'Div. Winner (%)', 'Make Playoffs (%)']].to_string(index=False))
+  # Print out the distribution of playoff seeds
+  df_seeds = (
+    pd.merge(df_sim_results[['team_id', 'firstName', 'lastName']], df_seeds, on='team_id')
+    .drop('team_id', axis=1)
+  )
+  logger.info('Simulated playoff seed and bracket distribution (%)')
+  print(df_seeds.to_string(index=False))
+  # Print out the odds if each team wins or loses next week
+  df_what_if = (
+    pd.merge(df_teams[['team_id', 'firstName', 'lastName']], df_what_if, on='team_id')
+    .merge(df_teams[['team_id', 'firstName']].rename({'team_id': 'opp_id', 'firstName': 'Opponent'}, axis=1),
+           on='opp_id')
+    .sort_values(by='Make Playoffs (%)', ascending=False)
+    .drop(['team_id', 'opp_id'], axis=1)
+  )
+  logger.info('Playoff odds (%) if each team wins or loses next week')
+  print(df_what_if.to_string(index=False))
+  # Print out the distribution of final win totals
+  df_win_dist = (
+    pd.merge(df_sim_results[['team_id', 'firstName', 'lastName']], win_dist, on='team_id')
+    .drop('team_id', axis=1)
+  )
+  logger.info('Final win total distribution (%)')
+  print(df_win_dist.to_string(index=False))
+  # Compare the precision of each way of drawing scores on this league
+  if compare_variance:
+    logger.info('Comparing variance reduction methods')
+    df_compare = compare_variance_reduction(
+      teams=teams,
+      df_remaining=get_remaining_games(teams=teams, schedule=df_schedule, week=week, reg_season=reg_season),
+      n_wc=n_wc,
+      n_sims=chunk_size,
+      seed=seed,
+      score_model=model)
+    print(df_compare.to_string(index=False))
+  # Show how the odds moved over the season
+  if backfill:
+    # The weeks share normal draws, so the backfill always uses normal fits whatever the score model
+    logger.info(f'Calculating playoff odds as of weeks 1-{week} with normal score fits')
+    df_by_week = calc_odds_by_week(
+      teams=teams,
+      schedule=df_schedule,
+      week=week,
+      reg_season=reg_season,
+      n_wc=n_wc,
+      n_sims=n_sims,
+      chunk_size=chunk_size,
+      seed=seed)
+    plot_odds_by_week(df_by_week=df_by_week, teams=teams, week=week, year=year)
+    df_by_week = (
+      pd.merge(df_sim_results[['team_id', 'firstName', 'lastName']],
+               df_by_week.pivot(index='team_id', columns='week', values='playoff_pct').reset_index(),
+               on='team_id')
+      .drop('team_id', axis=1)
+    )
+    logger.info('Make playoffs (%) as of each week')
+    print(df_by_week.to_string(index=False))
   return
 
 
-def run_simulation(teams, schedule, week, reg_season, n_sims, n_wc, year):
+def run_simulation(teams, schedule, week, reg_season, n_sims, n_wc, year,
+                   chunk_size=10000, n_workers=1, seed=None,
+                   n_checkpoints=100, log_checkpoints=False, adaptive=False, target_se=0.005,
+                   max_sims=1000000, exact_games=-1, n_tiebreak_draws=32, variance_reduction='none',
+                   period_length=1, cache=False, score_model=None, plot=True):
   """Run simulations, aggregate and plot results
 
+  In adaptive mode chunks are simulated until every team's playoff,
+  division and wildcard probability has a standard error below
+  target_se, or max_sims is reached, and the convergence checkpoints
+  fall on the chunk boundaries. When at most exact_games games remain,
+  every win/loss outcome is enumerated instead and weighted by its
+  probability, and there is nothing to plot. The enumeration is exact in
+  wins only: the points for tiebreak of each outcome is sampled from a
+  normal approximation, so it depends on the seed. exact_games is capped
+  at MAX_EXACT_GAMES.
+  Each iteration's seeds are then carried through the playoff bracket.
+  With cache, the summed results and the fits are stored under a hash of
+  the inputs, and a rerun with the same inputs loads them instead of
+  simulating. Simulations are always run in chunks
+  with their own random streams, so memory use is bounded by chunk_size
+  and a seed gives the same results for any number of workers.
+
   :param teams: data frame with team data
   :param schedule: data frame with schedule data
   :param week: current week
@@ -89,211 +214,778 @@ def run_simulation(teams, schedule, week, reg_season, n_sims, n_wc, year):
   :param n_sims: number of simulations to run
   :param n_wc: number of wild card spots
   :param year: current year
-  :return: results of simulation
+  :param chunk_size: number of simulations per chunk
+  :param n_workers: number of processes to split the simulations across
+  :param seed: seed for the simulations, results are reproducible for a given seed
+  :param n_checkpoints: number of points on the convergence plots
+  :param log_checkpoints: flag to space the convergence checkpoints logarithmically
+  :param adaptive: flag to simulate chunks until the odds reach the target standard error
+  :param target_se: largest standard error allowed on any probability in adaptive mode
+  :param max_sims: cap on the number of simulations in adaptive mode
+  :param exact_games: enumerate every outcome instead of simulating when at most this many games remain
+  :param n_tiebreak_draws: number of points for draws for each enumerated outcome
+  :param variance_reduction: how to draw the simulated scores, one of 'none', 'antithetic' or 'qmc'
+  :param period_length: number of matchup periods in each playoff round
+  :param cache: flag to save simulations under output/{year}, and reuse them when the seed and inputs match
+  :param score_model: fitted ScoreModel to draw scores from, defaults to normals from teams.score_fit
+  :param plot: flag to save the convergence plots
+  :return: playoff odds, distribution of playoff seeds and bracket rounds
+    for each team, odds if each team wins or loses next week, and number of
+    simulations run (None for enumeration)
   """
-  logger.info(f'Generating simulated scores for {n_sims} seasons')
-  df_sim = generate_simulations(
+  if variance_reduction not in VARIANCE_REDUCTION_METHODS:
+    raise ValueError(f'Unknown variance reduction method: {variance_reduction}')
+  if variance_reduction == 'qmc' and qmc is None:
+    logger.warning('Sobol sequences need scipy>=1.7, falling back to plain Monte Carlo')
+    variance_reduction = 'none'
+  seed_seq = np.random.SeedSequence(seed)
+  logger.info(f'Simulation seed: {seed_seq.entropy}')
+  df_remaining = get_remaining_games(
     teams=teams,
     schedule=schedule,
     week=week,
-    reg_season=reg_season,
-    n_sims=n_sims)
-  logger.info('Summarising statistics in each simulated season')
-  df_sum = summarise_simulations(
-    df_sim=df_sim,
+    reg_season=reg_season)
+  n_div = teams.divisionId.nunique()
+  n_games = df_remaining.shape[0]
+  # Next week's games, for the what-if odds
+  next_games = np.flatnonzero(df_remaining.matchupPeriodId.values == df_remaining.matchupPeriodId.min())
+  # Chance each team beats each other team, shared by the enumeration and the bracket
+  win_probs = calc_win_prob_matrix(teams) if score_model is None else score_model.win_prob_matrix()
+  if exact_games > MAX_EXACT_GAMES:
+    logger.warning(f'exact_games={exact_games} would enumerate up to 2^{exact_games} outcomes, '
+                   f'capping it at {MAX_EXACT_GAMES}')
+    exact_games = MAX_EXACT_GAMES
+  if n_games <= exact_games:
+    logger.info(f'Enumerating all {2**n_games} outcomes of the {n_games} remaining games')
+    home_scores, away_scores, home_vars, away_vars, weights = enumerate_outcomes(
+      teams=teams,
+      df_remaining=df_remaining,
+      win_probs=win_probs)
+    tot_wins, tot_pts = summarise_simulations(
+      home_scores=home_scores,
+      away_scores=away_scores,
+      df_remaining=df_remaining,
+      teams=teams)
+    tot_pts = draw_tiebreak_points(
+      tot_pts=tot_pts,
+      home_vars=home_vars,
+      away_vars=away_vars,
+      df_remaining=df_remaining,
+      rng=np.random.default_rng(seed_seq),
+      n_draws=n_tiebreak_draws)
+    # Every draw of an outcome shares its results and a share of its weight
+    tot_wins = np.repeat(tot_wins, n_tiebreak_draws, axis=0)
+    outcomes = np.repeat(np.packbits(home_scores > away_scores, axis=1), n_tiebreak_draws, axis=0)
+    weights = np.repeat(weights / n_tiebreak_draws, n_tiebreak_draws)
+    seeds = calc_playoff_seeds(
+      tot_wins=tot_wins,
+      tot_pts=tot_pts,
+      divisions=teams.divisionId.values,
+      n_wc=n_wc)
+    seed_probs = count_seeds(
+      seeds=seeds,
+      spots=n_div+n_wc,
+      weights=weights)
+    bracket_probs = calc_bracket_odds(
+      seeds=seeds,
+      win_probs=win_probs,
+      n_spots=n_div+n_wc,
+      period_length=period_length,
+      weights=weights)
+    df_results, df_seeds = build_seed_tables(
+      teams=teams, seed_pct=100*seed_probs, bracket_pct=100*bracket_probs, n_div=n_div)
+    what_if_counts, what_if_totals = count_what_if(
+      seeds=seeds,
+      outcomes=outcomes,
+      games=next_games,
+      weights=weights)
+    df_what_if = build_what_if_table(
+      teams=teams,
+      df_remaining=df_remaining,
+      games=next_games,
+      what_if_counts=what_if_counts,
+      what_if_totals=what_if_totals)
+    return df_results, df_seeds, df_what_if, None
+  if adaptive:
+    n_sims = max_sims
+    checkpoints = np.minimum(np.arange(chunk_size, n_sims + chunk_size, chunk_size), n_sims)
+  else:
+    target_se = None
+    checkpoints = get_checkpoints(
+      n_sims=n_sims,
+      n_checkpoints=n_checkpoints,
+      log_spaced=log_checkpoints)
+  # Without a seed every run should draw fresh simulations
+  cache = cache and seed is not None
+  stored = None
+  if cache:
+    fits = np.array([fit[:2] for fit in teams.score_fit])
+    key = get_store_key(
+      fits,
+      teams[['team_id', 'divisionId', 'wins', 'points_for']].values.astype(float),
+      df_remaining[['home_idx', 'away_idx', 'matchupPeriodId']].values,
+      n_sims=n_sims, n_wc=n_wc, seed=seed, chunk_size=chunk_size,
+      target_se=target_se, variance_reduction=variance_reduction, period_length=period_length,
+      checkpoints=checkpoints.tolist(), score_model=getattr(score_model, 'name', None))
+    stored = load_store(year=year, key=key)
+  if stored is not None:
+    div_by_iter, wc_by_iter, seed_counts, bracket_counts, what_if_counts, what_if_totals, checkpoints = (
+      stored[name] for name in ('div_by_iter', 'wc_by_iter', 'seed_counts', 'bracket_counts',
+                                'what_if_counts', 'what_if_totals', 'checkpoints'))
+    n_sims = int(stored['n_sims'])
+  else:
+    logger.info(f'Streaming up to {n_sims} simulated seasons in chunks of {chunk_size} with {n_workers} worker(s)')
+    div_by_iter, wc_by_iter, seed_counts, bracket_counts, what_if_counts, what_if_totals, n_sims = stream_simulations(
+      teams=teams,
+      df_remaining=df_remaining,
+      n_sims=n_sims,
+      n_wc=n_wc,
+      chunk_size=chunk_size,
+      checkpoints=checkpoints,
+      seed_seq=seed_seq,
+      n_workers=n_workers,
+      target_se=target_se,
+      variance_reduction=variance_reduction,
+      period_length=period_length,
+      what_if_games=next_games,
+      score_model=score_model,
+      win_probs=win_probs)
+    checkpoints = checkpoints[checkpoints <= n_sims]
+    if adaptive:
+      logger.info(f'Reached a standard error of {max_std_err(seed_counts, n_div, n_sims):.4f} '
+                  f'after {n_sims} simulations (target {target_se}, cap {max_sims})')
+  if cache and stored is None:
+    save_store(
+      create_store(year=year, key=key),
+      fits=fits,
+      div_by_iter=div_by_iter,
+      wc_by_iter=wc_by_iter,
+      seed_counts=seed_counts,
+      bracket_counts=bracket_counts,
+      what_if_counts=what_if_counts,
+      what_if_totals=what_if_totals,
+      checkpoints=checkpoints,
+      n_sims=np.array(n_sims),
+      week=np.array(week))
+  if plot:
+    logger.info('Summarising simulated playoff percentages for plotting')
+    df_plot = calc_playoff_pct_by_iter(
+      teams=teams,
+      div_by_iter=div_by_iter,
+      wc_by_iter=wc_by_iter,
+      checkpoints=checkpoints)
+    logger.info('Plotting playoff simulation results')
+    plot_simulation_results(
+      df_plot=df_plot,
+      week=week,
+      year=year,
+      log_x=log_checkpoints)
+  df_results, df_seeds = build_seed_tables(
+    teams=teams, seed_pct=100*seed_counts/n_sims, bracket_pct=100*bracket_counts/n_sims, n_div=n_div)
+  df_what_if = build_what_if_table(
+    teams=teams,
+    df_remaining=df_remaining,
+    games=next_games,
+    what_if_counts=what_if_counts,
+    what_if_totals=what_if_totals)
+  return df_results, df_seeds, df_what_if, n_sims
+
+
+def build_seed_tables(teams, seed_pct, bracket_pct, n_div):
+  """Summarise the seed distribution into playoff odds
+
+  :param teams: data frame with team data
+  :param seed_pct: percent of iterations each team lands on each seed, shape (n_teams, n_seeds)
+  :param bracket_pct: percent of iterations each team wins each playoff round, shape (n_teams, n_rounds)
+  :param n_div: number of divisions
+  :return: data frames with division/wildcard odds and with the seed and bracket distribution
+  """
+  # Division winners fill the first seeds, wildcards the rest
+  df_results = pd.DataFrame({'team_id': teams.team_id.values,
+                             'wc_pct': seed_pct[:, n_div:].sum(axis=1),
+                             'div_pct': seed_pct[:, :n_div].sum(axis=1)})
+  df_seeds = pd.DataFrame(seed_pct, columns=[f'Seed {i}' for i in range(1, seed_pct.shape[1]+1)])
+  df_seeds.insert(loc=0, column='team_id', value=teams.team_id.values)
+  # Name each round by the teams left after it
+  n_rounds = bracket_pct.shape[1]
+  round_names = {8: 'Quarterfinal', 4: 'Semifinal', 2: 'Final', 1: 'Champion'}
+  for r in range(n_rounds):
+    n_left = 2 ** (n_rounds - r - 1)
+    df_seeds[round_names.get(n_left, f'Round of {n_left}')] = bracket_pct[:, r]
+  return df_results, df_seeds
+
+
+def count_what_if(seeds, outcomes, games, weights=None):
+  """Count playoff appearances split by the result of each selected game
+
+  :param seeds: playoff seed of each team in each iteration (0 if missed)
+  :param outcomes: bit-packed game results, one bit per remaining game set when the home team wins
+  :param games: positions of the games to condition on
+  :param weights: optional weight of each iteration
+  :return: playoff counts with shape (n_games, 2, n_teams) and iteration
+    counts with shape (n_games, 2), for home wins then home losses
+  """
+  if weights is None:
+    weights = np.ones(seeds.shape[0])
+  home_wins = np.unpackbits(outcomes, axis=1)[:, games].astype(bool)
+  made = (seeds > 0).astype(float)
+  # Weight of each iteration under each result of each game, shape (n_sims, n_games, 2)
+  masks = np.stack([home_wins, ~home_wins], axis=2) * weights[:, None, None]
+  what_if_counts = np.einsum('ngr,nt->grt', masks, made)
+  return what_if_counts, masks.sum(axis=0)
+
+
+def build_what_if_table(teams, df_remaining, games, what_if_counts, what_if_totals):
+  """Playoff odds for each team playing in the selected games if it wins or loses
+
+  :param teams: data frame with team data
+  :param df_remaining: data frame with remaining games and team positions
+  :param games: positions of the games conditioned on
+  :param what_if_counts: playoff counts with shape (n_games, 2, n_teams), home wins then losses
+  :param what_if_totals: iteration counts with shape (n_games, 2)
+  :return: data frame with the team, opponent, and odds if it wins or loses
+  """
+  with np.errstate(divide='ignore', invalid='ignore'):
+    odds = 100 * what_if_counts / what_if_totals[:, :, None]
+  home_idx = df_remaining.home_idx.values[games]
+  away_idx = df_remaining.away_idx.values[games]
+  rows = np.arange(len(games))
+  team_ids = teams.team_id.values
+  overall = 100 * what_if_counts.sum(axis=1) / what_if_totals.sum(axis=1)[:, None]
+  return pd.DataFrame({
+    'team_id': np.concatenate([team_ids[home_idx], team_ids[away_idx]]),
+    'opp_id': np.concatenate([team_ids[away_idx], team_ids[home_idx]]),
+    'Make Playoffs (%)': np.concatenate([overall[rows, home_idx], overall[rows, away_idx]]),
+    'If Win (%)': np.concatenate([odds[rows, 0, home_idx], odds[rows, 1, away_idx]]),
+    'If Loss (%)': np.concatenate([odds[rows, 1, home_idx], odds[rows, 0, away_idx]])})
+
+
+def stream_simulations(teams, df_remaining, n_sims, n_wc, chunk_size, checkpoints, seed_seq, n_workers=1,
+                       target_se=None, variance_reduction='none', period_length=1, what_if_games=(),
+                       score_model=None, win_probs=None):
+  """Generate and reduce simulations chunk by chunk
+
+  Only per-team counters and the running totals at each convergence
+  checkpoint are kept, so peak memory is set by chunk_size, not n_sims.
+  Each chunk draws from its own child of seed_seq, so the results for a
+  given seed do not depend on how many workers process the chunks.
+  With a target_se, the simulations stop after the first chunk at which
+  the largest standard error of the playoff odds is below target_se.
+  :param teams: data frame with team data
+  :param df_remaining: data frame with remaining games and team positions
+  :param n_sims: number of simulations to run
+  :param n_wc: number of wild card spots
+  :param chunk_size: number of simulations per chunk
+  :param checkpoints: increasing simulation counts at which to record running totals
+  :param seed_seq: numpy SeedSequence to spawn the chunk random streams from
+  :param n_workers: number of processes to split the chunks across
+  :param target_se: optional standard error at which to stop simulating
+  :param variance_reduction: how to draw the simulated scores, one of 'none', 'antithetic' or 'qmc'
+  :param period_length: number of matchup periods in each playoff round
+  :param what_if_games: positions of the games to split the playoff odds on
+  :param score_model: fitted ScoreModel to draw scores from, defaults to normals from teams.score_fit
+  :param win_probs: chance each team beats each other team, for the bracket, defaults to the score model's
+  :return: division winner and wildcard counts at each checkpoint, with shape
+    (n_checkpoints, n_teams), seed counts with shape (n_teams, n_seeds),
+    expected playoff round wins with shape (n_teams, n_rounds), playoff and
+    iteration counts by game result (see count_what_if), and number of
+    simulations run. Checkpoints after an early stop are dropped.
+  """
+  n_teams = teams.team_id.size
+  n_div = teams.divisionId.nunique()
+  if win_probs is None:
+    win_probs = calc_win_prob_matrix(teams) if score_model is None else score_model.win_prob_matrix()
+  seed_counts = np.zeros((n_teams, n_div+n_wc))
+  bracket_counts = np.zeros((n_teams, int(np.ceil(np.log2(n_div+n_wc)))))
+  what_if_counts = np.zeros((len(what_if_games), 2, n_teams))
+  what_if_totals = np.zeros((len(what_if_games), 2))
+  div_counts = np.zeros(n_teams)
+  wc_counts = np.zeros(n_teams)
+  div_by_iter = np.zeros((checkpoints.size, n_teams))
+  wc_by_iter = np.zeros((checkpoints.size, n_teams))
+  starts = list(range(0, n_sims, chunk_size))
+  sizes = [min(chunk_size, n_sims - start) for start in starts]
+  chunk_results = map_chunks(
+    teams=teams,
+    df_remaining=df_remaining,
+    n_wc=n_wc,
+    sizes=sizes,
+    chunk_seeds=seed_seq.spawn(len(starts)),
+    n_workers=n_workers,
+    variance_reduction=variance_reduction,
+    score_model=score_model)
+  for start, n_chunk, (seeds, outcomes) in zip(starts, sizes, chunk_results):
+    seed_counts += count_seeds(seeds=seeds, spots=n_div+n_wc)
+    chunk_what_if = count_what_if(seeds=seeds, outcomes=outcomes, games=what_if_games)
+    what_if_counts += chunk_what_if[0]
+    what_if_totals += chunk_what_if[1]
+    bracket_counts += calc_bracket_odds(
+      seeds=seeds, win_probs=win_probs, n_spots=n_div+n_wc, period_length=period_length)
+    div_ind = (seeds > 0) & (seeds <= n_div)
+    wc_ind = seeds > n_div
+    # Record running totals at the checkpoints falling inside this chunk
+    in_chunk = (checkpoints > start) & (checkpoints <= start + n_chunk)
+    div_by_iter[in_chunk] = div_counts + count_at_checkpoints(div_ind, checkpoints[in_chunk] - start)
+    wc_by_iter[in_chunk] = wc_counts + count_at_checkpoints(wc_ind, checkpoints[in_chunk] - start)
+    div_counts += div_ind.sum(axis=0)
+    wc_counts += wc_ind.sum(axis=0)
+    n_done = start + n_chunk
+    if target_se is not None and max_std_err(seed_counts, n_div, n_done) < target_se:
+      break
+  reached = checkpoints <= n_done
+  return (div_by_iter[reached], wc_by_iter[reached], seed_counts, bracket_counts,
+          what_if_counts, what_if_totals, n_done)
+
+
+def max_std_err(seed_counts, n_div, n_sims):
+  """Largest standard error of the simulated playoff, division and wildcard odds
+
+  :param seed_counts: number of times each team finished in each seed, shape (n_teams, n_seeds)
+  :param n_div: number of divisions, division winners take the first seeds
+  :param n_sims: number of simulations the counts are taken from
+  :return: largest binomial standard error, sqrt(p*(1-p)/n), across teams and outcomes
+  """
+  p = np.stack([seed_counts.sum(axis=1),
+                seed_counts[:, :n_div].sum(axis=1),
+                seed_counts[:, n_div:].sum(axis=1)]) / n_sims
+  return np.sqrt(p * (1 - p) / n_sims).max()
+
+
+def compare_variance_reduction(teams, df_remaining, n_wc, n_sims=10000, n_reps=30, seed=None, score_model=None):
+  """Compare the precision of each variance reduction method on one league
+
+  Every method simulates the same n_reps replicate seeds of n_sims seasons.
+  The spread of the playoff, division and wildcard odds across replicates
+  gives each method's variance, and the effective sample size is the
+  number of plain Monte Carlo simulations with the same variance.
+  :param teams: data frame with team data
+  :param df_remaining: data frame with remaining games and team positions
+  :param n_wc: number of wild card spots
+  :param n_sims: number of simulations in each replicate
+  :param n_reps: number of replicates for each method
+  :param seed: seed for the replicates
+  :param score_model: fitted ScoreModel to draw scores from, defaults to normals from teams.score_fit
+  :return: data frame with the variance and effective sample size of each method
+  """
+  n_div = teams.divisionId.nunique()
+  rep_seeds = np.random.SeedSequence(seed).spawn(n_reps)
+  methods = [m for m in VARIANCE_REDUCTION_METHODS if m != 'qmc' or qmc is not None]
+  rows = []
+  for method in methods:
+    t_start = time.perf_counter()
+    odds = []
+    for rep_seed in rep_seeds:
+      seeds, _ = simulate_chunk(teams, df_remaining, n_wc, n_sims, rep_seed, method, score_model)
+      odds.append(np.concatenate([(seeds > 0).mean(axis=0),
+                                  ((seeds > 0) & (seeds <= n_div)).mean(axis=0),
+                                  (seeds > n_div).mean(axis=0)]))
+    elapsed = time.perf_counter() - t_start
+    rows.append({'method': method,
+                 'seconds': elapsed,
+                 'variance': np.var(odds, axis=0, ddof=1).sum()})
+  df_compare = pd.DataFrame(rows)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    df_compare['var. reduction'] = df_compare.variance.iloc[0] / df_compare.variance
+  df_compare['eff. sample size'] = n_sims * df_compare['var. reduction']
+  df_compare['eff. sims/s'] = n_reps * df_compare['eff. sample size'] / df_compare.seconds
+  return df_compare
+
+
+def map_chunks(teams, df_remaining, n_wc, sizes, chunk_seeds, n_workers=1, variance_reduction='none',
+               score_model=None):
+  """Simulate each chunk, optionally across a pool of processes
+
+  :param teams: data frame with team data
+  :param df_remaining: data frame with remaining games and team positions
+  :param n_wc: number of wild card spots
+  :param sizes: number of simulations in each chunk
+  :param chunk_seeds: SeedSequence for each chunk
+  :param n_workers: number of processes to split the chunks across
+  :param variance_reduction: how to draw the simulated scores, one of 'none', 'antithetic' or 'qmc'
+  :param score_model: fitted ScoreModel to draw scores from, defaults to normals from teams.score_fit
+  :return: iterator over the playoff seeds and bit-packed game results of each chunk, in order
+  """
+  if n_workers > 1:
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+      # Keep two chunks per worker in flight, so stopping early discards little work
+      pending = deque()
+      try:
+        for n_sims, chunk_seed in zip(sizes, chunk_seeds):
+          pending.append(executor.submit(
+            simulate_chunk, teams, df_remaining, n_wc, n_sims, chunk_seed, variance_reduction, score_model))
+          if len(pending) >= 2 * n_workers:
+            yield pending.popleft().result()
+        while pending:
+          yield pending.popleft().result()
+      finally:
+        for future in pending:
+          future.cancel()
+  else:
+    for n_sims, chunk_seed in zip(sizes, chunk_seeds):
+      yield simulate_chunk(teams, df_remaining, n_wc, n_sims, chunk_seed, variance_reduction, score_model)
+
+
+def simulate_chunk(teams, df_remaining, n_wc, n_sims, chunk_seed, variance_reduction='none', score_model=None):
+  """Simulate and reduce one chunk of seasons
+
+  :param teams: data frame with team data
+  :param df_remaining: data frame with remaining games and team positions
+  :param n_wc: number of wild card spots
+  :param n_sims: number of simulations in the chunk
+  :param chunk_seed: SeedSequence for the chunk
+  :param variance_reduction: how to draw the simulated scores, one of 'none', 'antithetic' or 'qmc'
+  :param score_model: fitted ScoreModel to draw scores from, defaults to normals from teams.score_fit
+  :return: playoff seed of each team in each iteration, shape (n_sims, n_teams),
+    and bit-packed game results, set when the home team wins
+  """
+  home_scores, away_scores = generate_simulations(
+    teams=teams,
+    df_remaining=df_remaining,
+    n_sims=n_sims,
+    rng=np.random.default_rng(chunk_seed),
+    dtype=np.float32,
+    variance_reduction=variance_reduction,
+    score_model=score_model)
+  tot_wins, tot_pts = summarise_simulations(
+    home_scores=home_scores,
+    away_scores=away_scores,
+    df_remaining=df_remaining,
     teams=teams)
-  logger.info('Calculating division winners and wildcards in each simulated season')
-  df_div_winners = get_div_winners(
-    df_sim=df_sum)
-  df_wc = get_wildcards(
-    df_sim=df_sum,
-    df_div_winners=df_div_winners,
+  seeds = calc_playoff_seeds(
+    tot_wins=tot_wins,
+    tot_pts=tot_pts,
+    divisions=teams.divisionId.values,
     n_wc=n_wc)
-  logger.info('Summarising simulated playoff percentages for plotting')
-  df_plot = calc_playoff_pct_by_iter(
-    teams=teams,
-    df_div_winners=df_div_winners,
-    df_wc=df_wc,
-    max_iters=n_sims,
-    step_size=int(n_sims/100))
-  df_plot = unnest(
-    df=df_plot,
-    explode=['x_vals', 'wc_pct', 'div_pct'])
-  logger.info('Plotting playoff simulation results')
-  plot_simulation_results(
-    df_plot=df_plot,
-    week=week,
-    year=year)
-  return df_plot.query('x_vals==x_vals.max()')[['team_id', 'wc_pct', 'div_pct']].reset_index(drop=True)
+  return seeds, np.packbits(home_scores > away_scores, axis=1)
 
 
-def generate_simulations(teams, schedule, week, reg_season, n_sims):
-  """Generate simulated scores for rest of season
+def get_remaining_games(teams, schedule, week, reg_season):
+  """Get the remaining regular season games, with team positions
 
+  The positions index the rows of the teams frame, so simulated
+  results can be accumulated directly into (n_sims, n_teams) arrays
   :param teams: data frame with team data
   :param schedule: data frame with schedule data
   :param week: current week
   :param reg_season: length of regular season
-  :param n_sims: number of simulations to run
-  :return: data frame with simulated scores
+  :return: data frame with one row per remaining game
   """
-  # Get remaining schedule
   df_remaining = (
     schedule[['home_id', 'away_id', 'matchupPeriodId']]
     .query(f'matchupPeriodId > {week} & matchupPeriodId <= {reg_season}')
     .reset_index(drop=True))
-  # Add in score profiles
-  df_remaining['home_score_fit'] = df_remaining.apply(
-    lambda x: teams[teams.get('team_id') == x.get('home_id')].get('score_fit').values[0], axis=1
-  )
-  df_remaining['away_score_fit'] = df_remaining.apply(
-    lambda x: teams[teams.get('team_id') == x.get('away_id')].get('score_fit').values[0], axis=1
-  )
-  # Add in simulated scores
-  df_remaining['home_scores'] = df_remaining.apply(
-    lambda x: norm.rvs(x.home_score_fit[0], x.home_score_fit[1], n_sims).tolist(), axis=1
-  )
-  df_remaining['away_scores'] = df_remaining.apply(
-    lambda x: norm.rvs(x.away_score_fit[0], x.away_score_fit[1], n_sims).tolist(), axis=1
-  )
+  team_idx = pd.Series(np.arange(teams.team_id.size), index=teams.team_id.values)
+  df_remaining['home_idx'] = team_idx.loc[df_remaining.home_id.values].values
+  df_remaining['away_idx'] = team_idx.loc[df_remaining.away_id.values].values
   return df_remaining
 
 
-def unnest(df, explode):
-  """Unnest columns that have lists into a row for each element
+def generate_simulations(teams, df_remaining, n_sims, rng=None, dtype=np.float64, variance_reduction='none',
+                         score_model=None):
+  """Generate simulated scores for rest of season
 
-  :param df: input data frame with nested columns
-  :param explode: list of columns to explode
-  :return: data frame with long format
+  With 'antithetic', the second half of the iterations mirror the
+  standard normal draws of the first half. With 'qmc', the draws are a
+  scrambled Sobol sequence mapped through the normal inverse CDF. A
+  score model maps the standard normal draws onto its own scores.
+  :param teams: data frame with team data
+  :param df_remaining: data frame with remaining games and team positions
+  :param n_sims: number of simulations to run
+  :param rng: numpy random generator used to draw scores
+  :param dtype: float type of the simulated scores
+  :param variance_reduction: how to draw the scores, one of 'none', 'antithetic' or 'qmc'
+  :param score_model: fitted ScoreModel to draw scores from, defaults to normals from teams.score_fit
+  :return: home and away scores, each with shape (n_sims, n_games)
   """
-  idx = df.index.repeat(df[explode[0]].str.len())
-  # Get index in each list we want to explode
-  idx2 = np.array([list(range(len(x))) for x in df[explode[0]]]).flatten()
-  # Explode each column in 'explode', and concat into columns
-  df1 = pd.concat([pd.DataFrame({x: np.concatenate(df[x].values)}) for x in explode], axis=1)
-  # Add in column for labeling index in exploded lists
-  df1 = pd.concat([df1, pd.DataFrame({'iteration': idx2})], axis=1)
-  df1.index = idx
-  return df1.join(df.drop(explode, 1), how='left')
-
-
-def summarise_simulations(df_sim, teams):
-  """Convert the wide format simulations into long format
-
-  summarise each iteration
-  :param df_sim: input data frame with simulated scores
+  if rng is None:
+    rng = np.random.default_rng()
+  # Unpack fitted score profiles into arrays indexed by team position
+  mu = np.array([fit[0] for fit in teams.score_fit], dtype=dtype)
+  sigma = np.array([fit[1] for fit in teams.score_fit], dtype=dtype)
+  home_idx = df_remaining.home_idx.values
+  away_idx = df_remaining.away_idx.values
+  n_games = home_idx.size
+  # Draw all games for all iterations at once
+  if variance_reduction == 'antithetic':
+    half = rng.standard_normal(((n_sims+1) // 2, 2*n_games), dtype=dtype)
+    draws = np.concatenate([half, -half])[:n_sims]
+    home_draws, away_draws = draws[:, :n_games], draws[:, n_games:]
+  elif variance_reduction == 'qmc':
+    sobol = qmc.Sobol(d=2*n_games, scramble=True, seed=rng)
+    with warnings.catch_warnings():
+      # Balance is best for powers of two, but any number of points is unbiased
+      warnings.simplefilter('ignore')
+      draws = ndtri(sobol.random(n_sims)).astype(dtype)
+    home_draws, away_draws = draws[:, :n_games], draws[:, n_games:]
+  else:
+    home_draws = rng.standard_normal((n_sims, n_games), dtype=dtype)
+    away_draws = rng.standard_normal((n_sims, n_games), dtype=dtype)
+  if score_model is not None:
+    home_scores = score_model.transform(home_draws, home_idx).astype(dtype, copy=False)
+    away_scores = score_model.transform(away_draws, away_idx).astype(dtype, copy=False)
+    return home_scores, away_scores
+  home_scores = mu[home_idx] + sigma[home_idx] * home_draws
+  away_scores = mu[away_idx] + sigma[away_idx] * away_draws
+  return home_scores, away_scores
+
+
+def enumerate_outcomes(teams, df_remaining, win_probs=None):
+  """Enumerate every win/loss outcome of the remaining games
+
+  Each game's margin is the difference of the two fitted normals, so the
+  home team wins with probability ndtr(mu_diff/sigma_diff), and an outcome
+  is weighted by the product of its game probabilities. Each score is
+  carried as its mean and variance given the winner (truncated normal
+  moments), for the points for tiebreak. Given a win probability matrix,
+  the outcomes are weighted by it instead, e.g. for a non-normal score
+  model, with the score moments still from the normal approximation.
   :param teams: data frame with team data
-  :return: long format summarised by iteration
+  :param df_remaining: data frame with remaining games and team positions
+  :param win_probs: optional chance each team beats each other team, shape (n_teams, n_teams)
+  :return: home and away score means and variances, each with shape
+    (2^n_games, n_games), and the probability of each outcome
   """
-  df_sim_long = unnest(df=df_sim, explode=['home_scores', 'away_scores']).reset_index(drop=True)
-  # Add in indicators for win/loss
-  df_sim_long['home_wins'] = df_sim_long['home_scores'] > df_sim_long['away_scores']
-  df_sim_long['away_wins'] = df_sim_long['away_scores'] > df_sim_long['home_scores']
-  # Aggregate by home/away and iteration
-  df_home_sum = (
-    df_sim_long
-    .groupby(['home_id', 'iteration'], as_index=False)
-    .agg({'home_scores': 'sum', 'home_wins': 'sum'})
-    .astype(float)
-    .rename({'home_id': 'team_id'}, axis=1)
-  )
-  df_away_sum = (
-    df_sim_long
-    .groupby(['away_id', 'iteration'], as_index=False)
-    .agg({'away_scores': 'sum', 'away_wins': 'sum'})
-    .astype(float)
-    .rename({'away_id': 'team_id'}, axis=1)
-  )
-  # Combine home away summaries
-  df_sim_sum = pd.merge(df_home_sum,
-                        df_away_sum,
-                        on=['team_id', 'iteration'], how='outer').fillna(0).reset_index(drop=True)
+  mu = np.array([fit[0] for fit in teams.score_fit])
+  sigma = np.array([fit[1] for fit in teams.score_fit])
+  home_idx = df_remaining.home_idx.values
+  away_idx = df_remaining.away_idx.values
+  n_games = home_idx.size
+  # Home margin D = H - A is normal, home wins when D > 0
+  mu_h, mu_a = mu[home_idx], mu[away_idx]
+  var_h, var_a = sigma[home_idx] ** 2, sigma[away_idx] ** 2
+  var_d = var_h + var_a
+  z = (mu_h - mu_a) / np.sqrt(var_d)
+  p_home = ndtr(z) if win_probs is None else win_probs[home_idx, away_idx]
+  # Inverse Mills ratios of the standardized margin, E[D | D > 0] = mu_d + sigma_d * lam_win, etc.
+  tiny = np.finfo(float).tiny
+  lam_win = norm.pdf(z) / np.maximum(ndtr(z), tiny)
+  lam_loss = norm.pdf(z) / np.maximum(ndtr(-z), tiny)
+  # Variance of the standardized margin given the winner
+  v_win = np.clip(1 - z * lam_win - lam_win ** 2, 0, 1)
+  v_loss = np.clip(1 + z * lam_loss - lam_loss ** 2, 0, 1)
+  # Bit j of the outcome index is 1 when the home team wins game j
+  home_wins = (np.arange(2 ** n_games)[:, None] >> np.arange(n_games) & 1).astype(bool)
+  weights = np.prod(np.where(home_wins, p_home, 1 - p_home), axis=1)
+  # Each score is its regression on the margin plus independent noise
+  lam = np.where(home_wins, lam_win, -lam_loss)
+  v_margin = np.where(home_wins, v_win, v_loss)
+  home_scores = mu_h + var_h / np.sqrt(var_d) * lam
+  away_scores = mu_a - var_a / np.sqrt(var_d) * lam
+  home_vars = var_h * var_a / var_d + var_h ** 2 / var_d * v_margin
+  away_vars = var_h * var_a / var_d + var_a ** 2 / var_d * v_margin
+  return home_scores, away_scores, home_vars, away_vars, weights
+
+
+def draw_tiebreak_points(tot_pts, home_vars, away_vars, df_remaining, rng, n_draws=32):
+  """Settle the points for tiebreak of enumerated outcomes by sampling
+
+  Given an outcome, each team's points for is approximated by a normal
+  with the summed means and variances of its remaining scores, and n_draws
+  are taken from it, so teams tied on wins are ordered with the chance one
+  outscores the other rather than always by their expected points.
+  :param tot_pts: expected total points for each outcome and team
+  :param home_vars: variance of each home score given the outcome, shape (n_outcomes, n_games)
+  :param away_vars: variance of each away score given the outcome, shape (n_outcomes, n_games)
+  :param df_remaining: data frame with remaining games and team positions
+  :param rng: numpy random Generator for the draws
+  :param n_draws: number of draws for each outcome
+  :return: total points with shape (n_outcomes * n_draws, n_teams), the draws of each outcome in consecutive rows
+  """
+  n_outcomes, n_teams = tot_pts.shape
+  pts_var = home_vars @ np.eye(n_teams)[df_remaining.home_idx.values] + \
+    away_vars @ np.eye(n_teams)[df_remaining.away_idx.values]
+  draws = rng.standard_normal((n_outcomes, n_draws, n_teams))
+  return (tot_pts[:, None, :] + np.sqrt(pts_var)[:, None, :] * draws).reshape(-1, n_teams)
+
+
+def summarise_simulations(home_scores, away_scores, df_remaining, teams):
+  """Accumulate simulated games into season totals for each iteration
+
+  Each game's wins and points are scatter-added onto the home and away
+  team columns through one-hot (n_games, n_teams) incidence matrices
+  :param home_scores: simulated home scores, shape (n_sims, n_games)
+  :param away_scores: simulated away scores, shape (n_sims, n_games)
+  :param df_remaining: data frame with remaining games and team positions
+  :param teams: data frame with team data
+  :return: total wins and total points, each with shape (n_sims, n_teams)
+  """
+  n_games = df_remaining.home_idx.size
+  n_teams = teams.team_id.size
+  # Incidence matrices map each game column onto its home/away team column
+  home_inc = np.zeros((n_games, n_teams), dtype=home_scores.dtype)
+  away_inc = np.zeros((n_games, n_teams), dtype=away_scores.dtype)
+  home_inc[np.arange(n_games), df_remaining.home_idx.values] = 1
+  away_inc[np.arange(n_games), df_remaining.away_idx.values] = 1
+  # Indicators for win/loss
+  home_wins = (home_scores > away_scores).astype(home_scores.dtype)
+  away_wins = (away_scores > home_scores).astype(away_scores.dtype)
   # Add in season stats
-  df_sim_sum = pd.merge(df_sim_sum,
-                        teams[['team_id', 'divisionId', 'wins', 'points_for']],
-                        on=['team_id']).reset_index(drop=True)
-  # Add in total wins/points
-  df_sim_sum['tot_wins'] = df_sim_sum['home_wins'] + df_sim_sum['away_wins'] + df_sim_sum['wins']
-  df_sim_sum['tot_pts'] = df_sim_sum['home_scores'] + df_sim_sum['away_scores'] + df_sim_sum['points_for']
-  # Drop unnecessary columns
-  df_sim_sum = df_sim_sum.drop(['home_scores', 'home_wins', 'away_scores', 'away_wins', 'wins', 'points_for'], 1)
-  return df_sim_sum
-
-
-def get_div_winners(df_sim):
-  """Calculate division winners with summarised simulation data
-
-  :param df_sim: data frame with simulated scores summarised by iteration
-  :return: data frame with division winners per iteration
+  tot_wins = home_wins @ home_inc + away_wins @ away_inc + teams.wins.values
+  tot_pts = home_scores @ home_inc + away_scores @ away_inc + teams.points_for.values
+  return tot_wins, tot_pts
+
+
+def calc_playoff_seeds(tot_wins, tot_pts, divisions, n_wc):
+  """Seed the playoffs in every iteration at once
+
+  Teams are ranked by wins, then points for. One lexsort orders each
+  division within every iteration, so the division winners sit at fixed
+  offsets. A second lexsort puts division winners ahead of everyone else
+  to give the seeding order.
+  :param tot_wins: total wins for each iteration and team
+  :param tot_pts: total points for each iteration and team
+  :param divisions: division id for each team position
+  :param n_wc: number of wild card spots
+  :return: playoff seed of each team in each iteration (0 if missed), shape (n_sims, n_teams)
   """
-  return (
-    df_sim
-    .sort_values(by=['tot_wins', 'tot_pts'], ascending=[False, False])
-    .groupby(['iteration', 'divisionId'])
-    .head(1)
-    .sort_values(by=['divisionId', 'iteration'])
-    .reset_index(drop=True)
-  )
+  n_sims, n_teams = tot_wins.shape
+  _, div_pos = np.unique(divisions, return_inverse=True)
+  div_sizes = np.bincount(div_pos)
+  n_div = div_sizes.size
+  # Order teams by division, then best record first
+  by_div = np.lexsort((-tot_pts, -tot_wins, np.broadcast_to(div_pos, tot_wins.shape)), axis=1)
+  div_starts = np.concatenate([[0], np.cumsum(div_sizes)[:-1]])
+  is_div_winner = np.zeros(tot_wins.shape, dtype=bool)
+  np.put_along_axis(is_div_winner, by_div[:, div_starts], True, axis=1)
+  # Division winners first, then wildcards, each by record
+  seed_order = np.lexsort((-tot_pts, -tot_wins, ~is_div_winner), axis=1)
+  seeds = np.zeros((n_sims, n_teams), dtype=np.int8)
+  np.put_along_axis(seeds, seed_order[:, :n_div+n_wc], np.arange(1, n_div+n_wc+1, dtype=np.int8), axis=1)
+  return seeds
 
 
-def get_wildcards(df_sim, df_div_winners, n_wc):
-  """Calculate wildcards per simulation
+def count_seeds(seeds, spots, weights=None):
+  """Count how often each team lands on each playoff seed
 
-  :param df_sim: simulated data
-  :param df_div_winners: data frame with div winners in each iteration
-  :param n_wc: number of wildcard positions open
-  :return: data frame with wildcard teams per iteration
+  :param seeds: playoff seed of each team in each iteration (0 if missed)
+  :param spots: number of playoff spots
+  :param weights: optional weight of each iteration
+  :return: counts (or summed weights) with shape (n_teams, spots)
   """
-  return (
-    df_sim
-    .merge(df_div_winners[['team_id', 'iteration']], on=['team_id', 'iteration'], how='left', indicator=True)
-    .query('_merge=="left_only"')
-    .drop('_merge', 1)
-    .sort_values(by=['tot_wins', 'tot_pts'], ascending=[False, False])
-    .groupby('iteration')
-    .head(n_wc)
-    .sort_values(by='iteration')
-    .reset_index(drop=True)
-  )
+  n_teams = seeds.shape[1]
+  flat = np.arange(n_teams) * (spots+1) + seeds
+  if weights is not None:
+    weights = np.repeat(weights, n_teams)
+  counts = np.bincount(flat.ravel(), weights=weights, minlength=n_teams*(spots+1)).reshape(n_teams, spots+1)
+  return counts[:, 1:]
+
+
+def get_bracket_order(n_slots):
+  """Seed in each slot of a standard bracket, where the top seeds meet last
+
+  :param n_slots: number of bracket slots, a power of two
+  :return: seed for each slot, e.g. [1, 4, 2, 3] for 4 slots
+  """
+  order = np.array([1])
+  while order.size < n_slots:
+    order = np.stack([order, 2*order.size + 1 - order], axis=1).ravel()
+  return order
+
+
+def calc_bracket_odds(seeds, win_probs, n_spots, period_length=1, weights=None):
+  """Carry each iteration's playoff seeds through a fixed bracket
+
+  The bracket is filled to a power of two with byes for the top seeds.
+  Instead of drawing playoff scores, each iteration's bracket is resolved
+  exactly from the head-to-head win probabilities: slot reach probabilities
+  are pushed through one round at a time against every possible opponent.
+  A round's score is the sum over period_length matchup periods, which
+  scales each matchup's normal z-score by sqrt(period_length).
+  :param seeds: playoff seed of each team in each iteration (0 if missed)
+  :param win_probs: chance each team beats each other team in one matchup period, shape (n_teams, n_teams)
+  :param n_spots: number of playoff spots
+  :param period_length: number of matchup periods in each playoff round
+  :param weights: optional weight of each iteration
+  :return: summed probability each team wins each playoff round, shape (n_teams, n_rounds)
+  """
+  n_sims, n_teams = seeds.shape
+  n_rounds = int(np.ceil(np.log2(n_spots)))
+  n_slots = 2 ** n_rounds
+  if weights is None:
+    weights = np.ones(n_sims)
+  # Team position in each slot, byes take position n_teams
+  by_seed = np.full((n_sims, n_slots), n_teams)
+  sims, team_pos = np.nonzero(seeds)
+  by_seed[sims, seeds[sims, team_pos] - 1] = team_pos
+  slots = by_seed[:, get_bracket_order(n_slots) - 1]
+  # Chance the row team beats the column team in one round, a bye always loses
+  p_beat = np.ones((n_teams+1, n_teams+1))
+  p_beat[:n_teams, :n_teams] = win_probs if period_length == 1 else ndtr(np.sqrt(period_length) * ndtri(win_probs))
+  p_beat[n_teams] = 0
+  reach = np.ones((n_sims, n_slots))
+  odds = np.zeros((n_teams+1, n_rounds))
+  size = 1
+  for r in range(n_rounds):
+    # Each block of 2*size slots plays down to one winner, left half against right half
+    block_teams = slots.reshape(n_sims, -1, 2, size)
+    block_reach = reach.reshape(n_sims, -1, 2, size)
+    p = p_beat[block_teams[:, :, 0, :, None], block_teams[:, :, 1, None, :]]
+    left = block_reach[:, :, 0] * np.einsum('nbij,nbj->nbi', p, block_reach[:, :, 1])
+    right = block_reach[:, :, 1] * np.einsum('nbij,nbi->nbj', 1 - p, block_reach[:, :, 0])
+    reach = np.stack([left, right], axis=2).reshape(n_sims, n_slots)
+    odds[:, r] = np.bincount(slots.ravel(), weights=(reach * weights[:, None]).ravel(), minlength=n_teams+1)
+    size *= 2
+  return odds[:n_teams]
+
+
+def get_checkpoints(n_sims, n_checkpoints=100, log_spaced=False):
+  """Choose the simulation counts at which to record convergence
+
+  :param n_sims: number of simulations to run
+  :param n_checkpoints: maximum number of checkpoints
+  :param log_spaced: flag to space checkpoints logarithmically instead of linearly
+  :return: increasing array of simulation counts, ending at n_sims
+  """
+  if log_spaced:
+    checkpoints = np.geomspace(1, n_sims, n_checkpoints)
+  else:
+    checkpoints = np.linspace(n_sims / n_checkpoints, n_sims, n_checkpoints)
+  return np.unique(np.maximum(np.round(checkpoints), 1).astype(int))
 
 
-def calc_playoff_pct_by_iter(teams, df_div_winners, df_wc, max_iters, step_size):
+def count_at_checkpoints(ind, checkpoints):
+  """Cumulative count of an indicator at each checkpoint
+
+  Sums the indicator between consecutive checkpoints, then takes one
+  cumulative sum over those segments
+  :param ind: indicator for each iteration and team, shape (n_sims, n_teams)
+  :param checkpoints: increasing simulation counts, each at most n_sims
+  :return: counts with shape (n_checkpoints, n_teams)
+  """
+  if checkpoints.size == 0:
+    return np.zeros((0, ind.shape[1]), dtype=np.int64)
+  starts = np.concatenate([[0], checkpoints[:-1]])
+  return np.cumsum(np.add.reduceat(ind[:checkpoints[-1]], starts, axis=0, dtype=np.int64), axis=0)
+
+
+def calc_playoff_pct_by_iter(teams, div_by_iter, wc_by_iter, checkpoints):
   """Calculate percentage of times team makes playoffs as function of simulation iteration
 
   :param teams: data frame with team data
-  :param df_div_winners: division winners by iteration
-  :param df_wc: wildcards by iteration
-  :param max_iters: number of simulations run
-  :param step_size: how often to calculate rolling percentage
-  :return: summarised data frame for plotting
+  :param div_by_iter: division winner counts at each checkpoint, shape (n_checkpoints, n_teams)
+  :param wc_by_iter: wildcard counts at each checkpoint, shape (n_checkpoints, n_teams)
+  :param checkpoints: simulation counts for each checkpoint
+  :return: long format data frame for plotting
   """
-  df_plot = teams[['team_id', 'firstName', 'divisionId']].reset_index(drop=True)
-  # Get list of iterations where each team is wildcard
-  df_plot['it_wc'] = df_plot.apply(lambda x: df_wc.query(f'team_id == {x.team_id}').iteration.tolist(), axis=1)
-  # Get list of iterations where each team is division winner
-  df_plot['it_div'] = df_plot.apply(lambda x: df_div_winners.query(f'team_id == {x.team_id}').iteration.tolist(), axis=1)
-  # Calculate rolling pct at specified step size
-  df_plot['wc_pct'] = df_plot['it_wc'].apply(
-    lambda x: [100*sum([xi < iter_checkpoint for xi in x])/float(iter_checkpoint)
-               for iter_checkpoint in list(range(step_size, max_iters+1, step_size))]
-  )
-  df_plot['div_pct'] = df_plot['it_div'].apply(
-    lambda x: [100*sum([xi < iter_checkpoint for xi in x])/float(iter_checkpoint)
-               for iter_checkpoint in list(range(step_size, max_iters+1, step_size))]
+  n_teams = teams.team_id.size
+  df_plot = (
+    teams[['team_id', 'firstName', 'divisionId']]
+    .iloc[np.tile(np.arange(n_teams), checkpoints.size)]
+    .reset_index(drop=True)
   )
-  # Drop the list of wc/div iterations by team
-  df_plot = df_plot.drop(['it_wc', 'it_div'], 1)
-  # Add in iteration counter for plotting
-  df_plot['x_vals'] = df_plot['team_id'].apply(lambda x: list(range(step_size, max_iters+1, step_size)))
+  df_plot['x_vals'] = np.repeat(checkpoints, n_teams)
+  df_plot['wc_pct'] = (100 * wc_by_iter / checkpoints[:, None]).ravel()
+  df_plot['div_pct'] = (100 * div_by_iter / checkpoints[:, None]).ravel()
   return df_plot
 
 
-def plot_simulation_results(df_plot, week, year):
+def plot_simulation_results(df_plot, week, year, log_x=False):
   """Make wildcard and division winner plots by simulation number
 
   :param df_plot: data frame with summarised simulation information
   :param week: current week
   :param year: current season
+  :param log_x: flag to use a log scale for the simulation axis
   :return: None
   """
   # Calculate label positions
@@ -301,11 +993,12 @@ def plot_simulation_results(df_plot, week, year):
     df_plot
     .query('x_vals==x_vals.max()')[['team_id', 'firstName', 'wc_pct', 'div_pct', 'x_vals']]
     .reset_index(drop=True))
-  x_scale_factor = df_plot_label_pos.x_vals.max() / df_plot_label_pos.team_id.size
-  df_plot_label_pos['wc_pct_pos'] = df_plot_label_pos.wc_pct.rank(method='first') * x_scale_factor
-  df_plot_label_pos['div_pct_pos'] = df_plot_label_pos.div_pct.rank(method='first') * x_scale_factor
+  x_max = df_plot_label_pos.x_vals.max()
+  n_labels = df_plot_label_pos.team_id.size
+  for col in ['wc_pct', 'div_pct']:
+    label_rank = df_plot_label_pos[col].rank(method='first')
+    df_plot_label_pos[f'{col}_pos'] = x_max ** (label_rank / n_labels) if log_x else label_rank * x_max / n_labels
   # Create wildcard plot
-  df_plot_label_pos
   p_wc = (
     ggplot(aes(x='x_vals',
                y='wc_pct',
@@ -343,6 +1036,9 @@ def plot_simulation_results(df_plot, week, year):
     guides(color=False) +
     ylim(0, 100)
   )
+  if log_x:
+    p_wc += scale_x_log10()
+    p_div += scale_x_log10()
   # Create directory to save plots
   out_dir = Path(f'output/{year}/week{week}')
   out_dir.mkdir(parents=True, exist_ok=True)
@@ -357,11 +1053,138 @@ def plot_simulation_results(df_plot, week, year):
   logger.info(f'Playoff simulation plots saved to: \n\t>{out_file_wc}\n\t>{out_file_div}')
 
 
-def calc_standings(teams, divisions, spots, week, reg_season):
+def calc_odds_by_week(teams, schedule, week, reg_season, n_wc, n_sims, chunk_size=10000, seed=None):
+  """Playoff odds as of the end of every week from 1 to the current week
+
+  The regular season schedule is turned into arrays once. Each chunk of
+  iterations draws one standard normal per team and game of the whole
+  season, and every week reuses those draws (common random numbers): a
+  game not yet played as of week w is simulated from the same draw with
+  the normal score fits as of week w, so the odds only move with the
+  results. The configured score model is not used here. Teams without a
+  score take the mean of the whole league, and teams with fewer than two
+  scores take its spread.
+  :param teams: data frame with team data
+  :param schedule: data frame with schedule data
+  :param week: current week
+  :param reg_season: length of regular season
+  :param n_wc: number of wild card spots
+  :param n_sims: number of simulations for each week
+  :param chunk_size: number of simulations per chunk
+  :param seed: seed for the simulations
+  :return: long data frame with team_id, week, div_pct, wc_pct and playoff_pct
+  """
+  df_season = get_remaining_games(teams=teams, schedule=schedule, week=0, reg_season=reg_season)
+  results = (
+    schedule[['matchupPeriodId', 'home_total_points', 'away_total_points', 'winner']]
+    .query(f'matchupPeriodId > 0 & matchupPeriodId <= {reg_season}')
+    .reset_index(drop=True))
+  n_teams = teams.team_id.size
+  n_div = teams.divisionId.nunique()
+  n_games = df_season.shape[0]
+  home_idx = df_season.home_idx.values
+  away_idx = df_season.away_idx.values
+  period = df_season.matchupPeriodId.values
+  decided = results.winner.values != 'UNDECIDED'
+  home_pts = results.home_total_points.values.astype(float)
+  away_pts = results.away_total_points.values.astype(float)
+  home_inc = np.zeros((n_games, n_teams))
+  away_inc = np.zeros((n_games, n_teams))
+  home_inc[np.arange(n_games), home_idx] = 1
+  away_inc[np.arange(n_games), away_idx] = 1
+  weeks = np.arange(1, week+1)
+  # Standings, score fits and remaining games as of each week
+  played = decided & (period <= weeks[:, None])
+  remaining = period > weeks[:, None]
+  home_won = played & (results.winner.values == 'HOME')
+  away_won = played & (results.winner.values == 'AWAY')
+  wins = home_won @ home_inc + away_won @ away_inc
+  points = (played * home_pts) @ home_inc + (played * away_pts) @ away_inc
+  points_sq = (played * home_pts**2) @ home_inc + (played * away_pts**2) @ away_inc
+  n_played = played @ home_inc + played @ away_inc
+  # Normal fits by maximum likelihood, as norm.fit
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mu = points / n_played
+    sigma = np.sqrt(np.maximum(points_sq / n_played - mu**2, 0))
+    # A single score has no spread, so fall back to the spread of all the league's scores
+    league_mu = points.sum(axis=1) / n_played.sum(axis=1)
+    league_sigma = np.sqrt(np.maximum(points_sq.sum(axis=1) / n_played.sum(axis=1) - league_mu**2, 0))
+  # A team without a decided game has no mean of its own either
+  mu = np.where(n_played == 0, league_mu[:, None], mu)
+  sigma = np.where((n_played < 2) | (sigma == 0), league_sigma[:, None], sigma)
+  seed_counts = np.zeros((weeks.size, n_teams, n_div+n_wc))
+  starts = range(0, n_sims, chunk_size)
+  for start, chunk_seed in zip(starts, np.random.SeedSequence(seed).spawn(len(starts))):
+    n_chunk = min(chunk_size, n_sims - start)
+    rng = np.random.default_rng(chunk_seed)
+    home_draws = rng.standard_normal((n_chunk, n_games))
+    away_draws = rng.standard_normal((n_chunk, n_games))
+    for i in range(weeks.size):
+      home_scores = mu[i, home_idx] + sigma[i, home_idx] * home_draws
+      away_scores = mu[i, away_idx] + sigma[i, away_idx] * away_draws
+      home_wins = (home_scores > away_scores) * remaining[i]
+      away_wins = (away_scores > home_scores) * remaining[i]
+      tot_wins = home_wins @ home_inc + away_wins @ away_inc + wins[i]
+      tot_pts = (home_scores * remaining[i]) @ home_inc + (away_scores * remaining[i]) @ away_inc + points[i]
+      seeds = calc_playoff_seeds(
+        tot_wins=tot_wins,
+        tot_pts=tot_pts,
+        divisions=teams.divisionId.values,
+        n_wc=n_wc)
+      seed_counts[i] += count_seeds(seeds=seeds, spots=n_div+n_wc)
+  df_by_week = pd.DataFrame({
+    'team_id': np.tile(teams.team_id.values, weeks.size),
+    'week': np.repeat(weeks, n_teams),
+    'div_pct': 100 * seed_counts[:, :, :n_div].sum(axis=2).ravel() / n_sims,
+    'wc_pct': 100 * seed_counts[:, :, n_div:].sum(axis=2).ravel() / n_sims})
+  df_by_week['playoff_pct'] = df_by_week['div_pct'] + df_by_week['wc_pct']
+  return df_by_week
+
+
+def plot_odds_by_week(df_by_week, teams, week, year):
+  """Plot each team's playoff odds as of every week
+
+  :param df_by_week: data frame with team_id, week and playoff_pct
+  :param teams: data frame with team data
+  :param week: current week
+  :param year: current season
+  :return: None
+  """
+  df_plot = pd.merge(df_by_week, teams[['team_id', 'firstName']], on='team_id')
+  p = (
+    ggplot(aes(x='week',
+               y='playoff_pct',
+               color='factor(team_id)',
+               group='team_id'),
+           data=df_plot) +
+    geom_line() +
+    geom_point() +
+    geom_label(aes(label='firstName'),
+               data=df_plot.query(f'week=={week}'),
+               size=10,
+               nudge_x=0.4) +
+    labs(x='Week', y='Make Playoffs (%)') +
+    theme_bw() +
+    guides(color=False) +
+    ylim(0, 100)
+  )
+  out_dir = Path(f'output/{year}/week{week}')
+  out_dir.mkdir(parents=True, exist_ok=True)
+  out_file = out_dir / 'playoffs_pct_by_week.png'
+  warnings.filterwarnings('ignore')
+  p.save(out_file, width=10, height=6, dpi=300)
+  warnings.filterwarnings('default')
+  logger.info(f'Playoff odds by week plot saved to: \n\t>{out_file}')
+
+
+def calc_standings(teams, schedule, divisions, spots, week, reg_season):
   """Calculate the current playoff standings
 
-  Division winners make it, then enough playoff teams to fill wildcard
+  Division winners make it, then enough playoff teams to fill wildcard.
+  Clinched and eliminated teams, and magic numbers, come from the exact
+  solver over the remaining schedule.
   :param teams: data frame with team data
+  :param schedule: data frame with schedule data
   :param divisions: dictionary of divisions
   :param spots: number of playoff spots
   :param week: current week
@@ -393,72 +1216,124 @@ def calc_standings(teams, divisions, spots, week, reg_season):
   df_standings['wildcard'] = df_standings.apply(
     lambda x: 1 if x.team_id in df_wc.team_id.tolist() else 0, axis=1
   )
-  # Get eliminated
-  df_eliminated = (
-    df_standings
-    .query(f'team_id not in {df_div_winners.team_id.tolist()+df_wc.team_id.tolist()}')
-    .query(f'{df_wc.tail(1).wins.values[0]} - wins  > {reg_season - week}')
-    .reset_index(drop=True)
-  )
+  # Get clinched and eliminated teams from the remaining schedule
+  df_status = calc_clinch_status(
+    teams=teams,
+    df_remaining=get_remaining_games(teams=teams, schedule=schedule, week=week, reg_season=reg_season),
+    n_wc=spots - len(divisions))
+  df_standings = pd.merge(df_standings, df_status, on='team_id')
+  df_eliminated = df_standings.query('eliminated_playoffs').reset_index(drop=True)
   # Select columns for printing
   df_div_winners['spot'] = 'Division Winner'
   df_wc['spot'] = 'Wild Card'
   df_eliminated['spot'] = 'Eliminated'
   playoff_cols = ['firstName', 'lastName', 'wins', 'points_for', 'spot', 'division']
   df_playoff_spots = pd.concat([df_div_winners[playoff_cols], df_wc[playoff_cols]]).reset_index(drop=True)
+  # Clinch markers: y division, x playoff spot, e eliminated
+  df_standings['status'] = np.select(
+    [df_standings.clinched_div, df_standings.clinched_playoffs, df_standings.eliminated_playoffs],
+    ['y', 'x', 'e'], default='')
+  df_standings['magic'] = df_standings.magic_number.apply(lambda x: '-' if pd.isnull(x) else str(int(x)))
+  df_magic = (
+    df_standings
+    .sort_values(by=['wins', 'points_for'], ascending=[False, False])
+    .rename({'games_left': 'left'}, axis=1)
+    [['firstName', 'lastName', 'division', 'wins', 'left', 'status', 'magic']]
+  )
   # Print the Current standings
   logger.info(f'Current Playoff Standings:\n{df_playoff_spots.to_string(index=False)}')
   logger.info(f'Teams Eliminated from Playoffs:\n{df_eliminated[playoff_cols].to_string(index=False)}')
+  logger.info(f'Clinch Status and Magic Numbers:\n{df_magic.to_string(index=False)}')
 
 
-def calc_exp_wins(teams, schedule, week, reg_season):
+def calc_exp_wins(teams, schedule, week, reg_season, win_probs=None):
   """Calculate expected wins for rest of season for each team
 
   Use fitted normal distribution for each team, combine distributions
-  and calculate cdf(0) for probability to win
+  and calculate cdf(0) for probability to win. Games are independent,
+  so each team's remaining wins follow a Poisson-binomial distribution,
+  built exactly by convolving in one game at a time.
   :param teams: data frame with teams and score profile
   :param schedule: data frame with schedule data
   :param week: current week
   :param reg_season: weeks in regular season
+  :param win_probs: optional chance each team beats each other team, shape (n_teams, n_teams)
+  :return: data frame with expected home/away/total wins for the rest of
+    the season, and data frame with the percent chance of each final win total
   """
-  # Get remaining schedule
-  df_remaining = schedule.query(f'matchupPeriodId > {week} & matchupPeriodId <= {reg_season}').reset_index(drop=True)
-  # Add in score profiles
-  df_remaining['home_score_fit'] = df_remaining.apply(
-    lambda x: teams[teams.get('team_id') == x.get('home_id')].get('score_fit').values[0], axis=1
-  )
-  df_remaining['away_score_fit'] = df_remaining.apply(
-    lambda x: teams[teams.get('team_id') == x.get('away_id')].get('score_fit').values[0], axis=1
-  )
-  # Calc prob home wins: subtract normal distributions and find cdf at 0
-  df_remaining['p_home_wins'] = df_remaining.apply(
-    lambda x: norm(x.away_score_fit[0] - x.home_score_fit[0],
-                   np.sqrt(x.home_score_fit[1] ** 2 + x.away_score_fit[1])).cdf(0), axis=1
-  )
+  df_remaining = get_remaining_games(teams=teams, schedule=schedule, week=week, reg_season=reg_season)
+  p_home = calc_win_probs(teams=teams, df_remaining=df_remaining, win_probs=win_probs)
+  n_teams = teams.team_id.size
+  home_idx = df_remaining.home_idx.values
+  away_idx = df_remaining.away_idx.values
   # Get expected home/away wins
-  df_expected_home_wins = (
-    df_remaining
-    .groupby('home_id')
-    .agg(home_wins=('p_home_wins', lambda x: sum(x)))
-    .reset_index()
-    .rename({'home_id': 'team_id'}, axis=1)
-  )
-  df_expected_away_wins = (
-    df_remaining
-    .groupby('away_id')
-    .agg(away_wins=('p_home_wins', lambda x: sum(1-x)))
-    .reset_index()
-    .rename({'away_id': 'team_id'}, axis=1)
-  )
-  # Combine home/away expected results and calculate total wins
-  df_expected = (
-    pd.merge(df_expected_home_wins, df_expected_away_wins, on='team_id', how='outer')
-    .reset_index(drop=True)
-    .fillna(0)
-  )
-  df_expected['total_wins'] = df_expected.apply(lambda x: x.home_wins+x.away_wins, axis=1)
-  return df_expected
+  df_expected = pd.DataFrame({
+    'team_id': teams.team_id.values,
+    'home_wins': np.bincount(home_idx, weights=p_home, minlength=n_teams),
+    'away_wins': np.bincount(away_idx, weights=1-p_home, minlength=n_teams)})
+  df_expected['total_wins'] = df_expected.home_wins + df_expected.away_wins
+  # Distribution of final win totals, shifted by current wins
+  dist = calc_win_distribution(
+    team_idx=np.concatenate([home_idx, away_idx]),
+    p_win=np.concatenate([p_home, 1-p_home]),
+    n_teams=n_teams)
+  wins = teams.wins.values.astype(int)
+  final = np.zeros((n_teams, wins.max() + dist.shape[1]))
+  rows, cols = np.indices(dist.shape)
+  final[rows, cols + wins[:, None]] = dist
+  first = wins.min()
+  df_win_dist = pd.DataFrame(100 * final[:, first:], columns=[str(w) for w in range(first, final.shape[1])])
+  df_win_dist.insert(loc=0, column='team_id', value=teams.team_id.values)
+  return df_expected, df_win_dist
 
 
+def calc_win_probs(teams, df_remaining, win_probs=None):
+  """Probability the home team wins each remaining game
+
+  Every game is looked up in the head-to-head win probability matrix
+  :param teams: data frame with teams and score profile
+  :param df_remaining: data frame with remaining games and team positions
+  :param win_probs: optional chance each team beats each other team, defaults to the normal fits
+  :return: probability the home team wins each game
+  """
+  if win_probs is None:
+    win_probs = calc_win_prob_matrix(teams)
+  return win_probs[df_remaining.home_idx.values, df_remaining.away_idx.values]
+
+
+def calc_win_prob_matrix(teams):
+  """Chance each team beats each other team from the fitted normals
+
+  The margin is the difference of the two normals, so every pair is
+  evaluated with one call to the normal cdf
+  :param teams: data frame with teams and score profile
+  :return: array with shape (n_teams, n_teams), 0.5 on the diagonal
+  """
+  mu = np.array([fit[0] for fit in teams.score_fit])
+  sigma = np.array([fit[1] for fit in teams.score_fit])
+  return ndtr((mu[:, None] - mu[None, :]) / np.sqrt(sigma[:, None] ** 2 + sigma[None, :] ** 2))
 
 
+def calc_win_distribution(team_idx, p_win, n_teams):
+  """Poisson-binomial distribution of wins for each team
+
+  Each team's win probabilities are padded with zeros to a common number
+  of games, then convolved in one game at a time for all teams at once
+  :param team_idx: team position for each team-game
+  :param p_win: probability of winning each team-game
+  :param n_teams: number of teams
+  :return: probability of each number of wins, shape (n_teams, max_games+1)
+  """
+  n_games = np.bincount(team_idx, minlength=n_teams)
+  # Position of each team-game within its team's games
+  order = np.argsort(team_idx, kind='stable')
+  slot = np.arange(team_idx.size) - np.repeat(np.cumsum(n_games) - n_games, n_games)
+  probs = np.zeros((n_teams, n_games.max(initial=0)))
+  probs[team_idx[order], slot] = p_win[order]
+  dist = np.zeros((n_teams, probs.shape[1]+1))
+  dist[:, 0] = 1
+  for game in range(probs.shape[1]):
+    p = probs[:, [game]]
+    dist[:, 1:] = dist[:, 1:] * (1-p) + dist[:, :-1] * p
+    dist[:, 0] *= 1 - p[:, 0]
+  return dist
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""Models of each team's weekly score distribution
+
+Every model is fit in one pass to a (n_teams, n_weeks) matrix of scores,
+with NaN where a team has no decided game, and maps standard normal draws
+onto scores. Simulations draw the normals (plain, antithetic or Sobol)
+and pass them through the model, so every model works with every way of
+drawing. Fits are cached per schedule, week and model.
+"""
+
+import logging
+from collections import OrderedDict
+import numpy as np
+from scipy.stats import t as student_t
+from scipy.special import ndtr
+from .sim_store import get_store_key
+
+__author__ = 'Ryne Carbone'
+
+logger = logging.getLogger(__name__)
+
+# Fitted models by (schedule hash, week, model name), least recently used first
+_fit_cache = OrderedDict()
+FIT_CACHE_SIZE = 32
+
+
+def get_score_matrix(df_schedule, team_ids, week):
+  """Arrange every decided score up to week into a team by week matrix
+
+  :param df_schedule: data frame with scores and team ids for each game
+  :param team_ids: team id for each row of the matrix
+  :param week: current week
+  :return: scores with shape (n_teams, n_weeks), NaN where a team has no score
+  """
+  played = df_schedule.query(f'matchupPeriodId <= {week} & winner != "UNDECIDED"')
+  team_pos = {team: i for i, team in enumerate(team_ids)}
+  weeks, col = np.unique(played.matchupPeriodId.values, return_inverse=True)
+  scores = np.full((len(team_ids), weeks.size), np.nan)
+  scores[[team_pos[team] for team in played.home_id], col] = played.home_total_points.values
+  scores[[team_pos[team] for team in played.away_id], col] = played.away_total_points.values
+  return scores
+
+
+class ScoreModel:
+  """Common interface of the score models
+
+  Subclasses set mean and std for every team in fit, and map standard
+  normal draws onto scores in transform. A team without a score takes the
+  mean of all the league's scores, and a team with fewer than two scores
+  takes their spread.
+  """
+  name = None
+
+  def __init__(self, scores):
+    self.scores = scores
+    has_score = ~np.isnan(scores)
+    self.n_scores = np.sum(has_score, axis=1)
+    self.league_mean = np.mean(scores[has_score])
+    self.league_std = np.std(scores[has_score])
+    with np.errstate(invalid='ignore', divide='ignore'):
+      mean = np.sum(np.where(has_score, scores, 0), axis=1) / self.n_scores
+      std = np.sqrt(np.sum(np.where(has_score, scores - mean[:, None], 0) ** 2, axis=1) / self.n_scores)
+    self.mean = np.where(self.n_scores == 0, self.league_mean, mean)
+    self.std = np.where((self.n_scores < 2) | (std == 0), self.league_std, std)
+    self._win_probs = None
+    self.fit()
+
+  def __repr__(self):
+    return f'{type(self).__name__}(n_teams={self.mean.size})'
+
+  def fit(self):
+    """Fit the model to the score matrix"""
+    raise NotImplementedError
+
+  def transform(self, z, team_idx):
+    """Map standard normal draws onto scores
+
+    :param z: standard normal draws, with the last axis matching team_idx
+    :param team_idx: team position for each column of z
+    :return: simulated scores with the shape of z
+    """
+    raise NotImplementedError
+
+  def win_prob(self, home_idx, away_idx):
+    """Probability the home team outscores the away team
+
+    Uses a normal approximation with each team's mean and standard deviation
+    :param home_idx: home team positions
+    :param away_idx: away team positions
+    :return: probability the home team wins each game
+    """
+    return ndtr((self.mean[home_idx] - self.mean[away_idx]) /
+                np.sqrt(self.std[home_idx] ** 2 + self.std[away_idx] ** 2))
+
+  def win_prob_matrix(self):
+    """Probability team i beats team j for every pair, computed once per fit
+
+    :return: array with shape (n_teams, n_teams), 0.5 on the diagonal
+    """
+    if self._win_probs is None:
+      home_idx, away_idx = np.indices((self.mean.size, self.mean.size))
+      self._win_probs = self.win_prob(home_idx.ravel(), away_idx.ravel()).reshape(home_idx.shape)
+      np.fill_diagonal(self._win_probs, 0.5)
+    return self._win_probs
+
+  @property
+  def params(self):
+    """Mean and standard deviation of each team, as (mu, sigma) tuples"""
+    return list(zip(self.mean, self.std))
+
+
+class NormalModel(ScoreModel):
+  """Normal scores with maximum likelihood mean and standard deviation, as norm.fit"""
+  name = 'normal'
+
+  def fit(self):
+    pass
+
+  def transform(self, z, team_idx):
+    return self.mean[team_idx] + self.std[team_idx] * z
+
+
+class StudentTModel(ScoreModel):
+  """Student-t scores, for heavier tails than the normal
+
+  One degrees of freedom is fit to the pooled standardized scores of the
+  whole league, since a handful of weeks can't pin down a tail per team.
+  Each team's scale is set so its variance matches its sample variance.
+  """
+  name = 'student_t'
+
+  def fit(self):
+    with np.errstate(invalid='ignore', divide='ignore'):
+      resid = ((self.scores - self.mean[:, None]) / self.std[:, None]).ravel()
+    resid = resid[np.isfinite(resid)]
+    df = student_t.fit(resid, floc=0)[0] if resid.size > 2 else np.inf
+    self.df = float(np.clip(df, 3, 100))
+    self.scale = self.std * np.sqrt((self.df - 2) / self.df)
+
+  def transform(self, z, team_idx):
+    return self.mean[team_idx] + self.scale[team_idx] * student_t.ppf(ndtr(z), self.df)
+
+
+class ShrinkageModel(ScoreModel):
+  """Normal scores with team means shrunk toward the league mean (empirical Bayes)
+
+  The spread of the true team means, tau^2, is the variance of the sample
+  means less their average sampling variance. Each mean is pulled toward
+  the league mean by B = se^2 / (se^2 + tau^2), and the standard deviation
+  is the pooled within-team spread plus the remaining uncertainty in the
+  team's mean. Teams without a score are left out of tau^2 and keep the
+  league mean.
+  """
+  name = 'shrinkage'
+
+  def fit(self):
+    has_score = self.n_scores > 0
+    n = np.maximum(self.n_scores, 1)
+    pooled_var = (np.nansum((self.scores - self.mean[:, None]) ** 2) /
+                  max(np.sum(np.maximum(self.n_scores - 1, 0)), 1))
+    se2 = pooled_var / n
+    tau2 = max(np.var(self.mean[has_score]) - se2[has_score].mean(), 0)
+    shrink = se2 / (se2 + tau2) if tau2 > 0 else np.ones_like(se2)
+    shrink = np.where(has_score, shrink, 1)
+    self.raw_mean = self.mean
+    self.mean = shrink * self.mean[has_score].mean() + (1 - shrink) * self.mean
+    self.std = np.sqrt(pooled_var + (1 - shrink) * se2)
+
+  def transform(self, z, team_idx):
+    return self.mean[team_idx] + self.std[team_idx] * z
+
+
+class BootstrapModel(ScoreModel):
+  """Resample each team's own scores
+
+  Each team's scores are sorted once into a padded array, and a draw is
+  the integer index floor(u * n_draws) into its row, with u = ndtr(z).
+  A team with fewer than two scores resamples all the league's scores,
+  shifted to its own mean.
+  """
+  name = 'bootstrap'
+
+  def fit(self):
+    self.sorted_scores = np.sort(self.scores, axis=1)
+    self.n_draws = self.n_scores
+    few = self.n_scores < 2
+    if few.any():
+      league_scores = np.sort(self.scores[~np.isnan(self.scores)])
+      width = max(self.scores.shape[1], league_scores.size)
+      sorted_scores = np.full((self.scores.shape[0], width), np.nan)
+      sorted_scores[:, :self.scores.shape[1]] = self.sorted_scores
+      sorted_scores[few, :league_scores.size] = league_scores + (self.mean[few] - self.league_mean)[:, None]
+      self.sorted_scores = sorted_scores
+      self.n_draws = np.where(few, league_scores.size, self.n_scores)
+
+  def transform(self, z, team_idx):
+    n = self.n_draws[team_idx]
+    idx = np.minimum((ndtr(z) * n).astype(np.int64), n - 1)
+    return self.sorted_scores[team_idx, idx]
+
+  def win_prob(self, home_idx, away_idx):
+    """Probability the home team outscores the away team, over all pairs of their scores
+
+    :param home_idx: home team positions
+    :param away_idx: away team positions
+    :return: probability the home team wins each game, counting ties as half
+    """
+    home = self.sorted_scores[home_idx][:, :, None]
+    away = self.sorted_scores[away_idx][:, None, :]
+    n_pairs = self.n_draws[home_idx] * self.n_draws[away_idx]
+    return (np.sum(home > away, axis=(1, 2)) + 0.5 * np.sum(home == away, axis=(1, 2))) / n_pairs
+
+
+SCORE_MODELS = {model.name: model for model in (NormalModel, StudentTModel, ShrinkageModel, BootstrapModel)}
+
+
+def fit_score_model(df_schedule, team_ids, week, model='normal'):
+  """Fit a score model to every team, reusing the fit for the same schedule, week and model
+
+  Up to FIT_CACHE_SIZE fits are kept, dropping the least recently used
+
+  :param df_schedule: data frame with scores and team ids for each game
+  :param team_ids: team ids, in the order of the fitted arrays
+  :param week: current week
+  :param model: name of the model, one of SCORE_MODELS
+  :return: fitted ScoreModel
+  """
+  if model not in SCORE_MODELS:
+    raise ValueError(f'Unknown score model: {model}')
+  schedule_key = get_store_key(
+    np.asarray(team_ids),
+    df_schedule[['home_id', 'away_id', 'matchupPeriodId', 'home_total_points', 'away_total_points']]
+    .values.astype(float),
+    winner=df_schedule.winner.tolist())
+  key = (schedule_key, week, model)
+  if key in _fit_cache:
+    _fit_cache.move_to_end(key)
+  else:
+    logger.debug(f'Fitting {model} score model for week {week}')
+    _fit_cache[key] = SCORE_MODELS[model](get_score_matrix(df_schedule, team_ids, week))
+    # Keep only the most recently used fits
+    if len(_fit_cache) > FIT_CACHE_SIZE:
+      _fit_cache.popitem(last=False)
+  return _fit_cache[key]
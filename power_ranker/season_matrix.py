@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""Dense team by week arrays of a season's results
+
+The season is held as a handful of (n_teams, n_weeks) NumPy arrays, with
+one row per team and one column per week that has a decided game. Season
+stats are reductions along the week axis, so they are computed for every
+team at once and only turned into data frames for reporting.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+__author__ = 'Ryne Carbone'
+
+logger = logging.getLogger(__name__)
+
+
+class SeasonMatrix:
+  """Scores, opponents and results of every decided game, by team and week
+
+  Cells where a team has no decided game hold NaN points, opponent -1 and
+  False for won, home and played. Running totals of the season stats
+  through every week are computed on first use, so the summary as of
+  any week is a column lookup instead of a re-filter of the games.
+  """
+  __slots__ = ('team_ids', 'weeks', 'points', 'opp_points', 'opponent', 'won', 'home', 'played', '_totals')
+
+  def __init__(self, team_ids, weeks, points, opp_points, opponent, won, home, played):
+    self.team_ids = team_ids
+    self.weeks = weeks
+    self.points = points
+    self.opp_points = opp_points
+    self.opponent = opponent
+    self.won = won
+    self.home = home
+    self.played = played
+    self._totals = None
+
+  def __repr__(self):
+    return f'SeasonMatrix(n_teams={self.team_ids.size}, n_weeks={self.weeks.size})'
+
+  @classmethod
+  def from_team_games(cls, df_games, week=None):
+    """Scatter the team-game table into team by week arrays
+
+    :param df_games: team-game table from build_team_game_table
+    :param week: last week to include, all weeks if None
+    :return: SeasonMatrix with a row for every team in df_games
+    """
+    if week is not None:
+      df_games = df_games.loc[(slice(None), slice(None, week)), :]
+    if df_games.empty:
+      logger.info('No games have been logged yet')
+      raise ValueError('No games have been logged yet')
+    team_ids, row = np.unique(df_games.index.get_level_values('team_id').values, return_inverse=True)
+    weeks, col = np.unique(df_games.index.get_level_values('week').values, return_inverse=True)
+    shape = (team_ids.size, weeks.size)
+    points = np.full(shape, np.nan)
+    points[row, col] = df_games.points.values
+    opp_points = np.full(shape, np.nan)
+    opp_points[row, col] = df_games.opp_points.values
+    opponent = np.full(shape, -1, dtype=np.int64)
+    opponent[row, col] = pd.Index(team_ids).get_indexer(df_games.opp_id.values)
+    won = np.zeros(shape, dtype=bool)
+    won[row, col] = df_games.result.values == 'W'
+    home = np.zeros(shape, dtype=bool)
+    home[row, col] = df_games.home.values
+    played = np.zeros(shape, dtype=bool)
+    played[row, col] = True
+    return cls(team_ids, weeks, points, opp_points, opponent, won, home, played)
+
+  def until(self, week):
+    """Restrict the season to games up to a week
+
+    :param week: last week to include
+    :return: SeasonMatrix sharing this one's team rows and running totals
+    """
+    n = np.searchsorted(self.weeks, week, side='right')
+    season = SeasonMatrix(self.team_ids, self.weeks[:n], self.points[:, :n], self.opp_points[:, :n],
+                          self.opponent[:, :n], self.won[:, :n], self.home[:, :n], self.played[:, :n])
+    # The weeks kept are a prefix, so the running totals carry over
+    if self._totals is not None:
+      season._totals = {name: total[..., :n] for name, total in self._totals.items()}
+    return season
+
+  def frame(self, **columns):
+    """Data frame of per-team values, one row per team
+
+    :param columns: arrays aligned with team_ids, by column name
+    :return: data frame with team_id and the given columns
+    """
+    return pd.DataFrame(dict(team_id=self.team_ids, **columns))
+
+  def align(self, values, team_ids):
+    """Reorder per-team values onto the rows of the matrix
+
+    :param values: values for each team
+    :param team_ids: team id for each value
+    :return: array of values aligned with team_ids of the matrix
+    """
+    return np.asarray(values)[pd.Index(team_ids).get_indexer(self.team_ids)]
+
+  def totals(self):
+    """Running totals of the season stats through each week, computed once
+
+    Each entry has shape (n_teams, n_weeks), where column k covers the games
+    through weeks[k], except agg_games which has one value per week
+    :return: dictionary of running totals by stat name
+    """
+    if self._totals is None:
+      points = np.where(self.played, self.points, 0.)
+      opp_points = np.where(self.played, self.opp_points, 0.)
+      totals = {}
+      for side, is_side in [('home', self.home), ('away', self.played & ~self.home)]:
+        totals[f'{side}_wins'] = np.cumsum(self.won & is_side, axis=1)
+        totals[f'{side}_games'] = np.cumsum(is_side, axis=1)
+        totals[f'{side}_points_for'] = np.cumsum(np.where(is_side, points, 0.), axis=1)
+        totals[f'{side}_points_against'] = np.cumsum(np.where(is_side, opp_points, 0.), axis=1)
+      totals['wins'] = np.cumsum(self.won, axis=1).astype(float)
+      totals['games'] = np.cumsum(self.played, axis=1).astype(float)
+      totals['points_for'] = np.cumsum(points, axis=1)
+      totals['points_against'] = np.cumsum(opp_points, axis=1)
+      totals['max_score'] = np.fmax.accumulate(self.points, axis=1)
+      totals['min_score'] = np.fmin.accumulate(self.points, axis=1)
+      totals['streak'] = self._running_streak()
+      totals['agg_wins'] = np.cumsum(self._weekly_agg_wins(), axis=1)
+      # Every team that plays in a week faces all the others that played
+      totals['agg_games'] = np.cumsum(np.sum(self.played, axis=0) - np.any(self.played, axis=0))
+      self._totals = totals
+    return self._totals
+
+  def _weekly_agg_wins(self):
+    """Teams outscored by each team each week, with ties counted as half
+
+    :return: aggregate wins with shape (n_teams, n_weeks)
+    """
+    # Compare every pair of teams each week, shape (team, opponent, week)
+    p = self.points
+    n_below = np.sum(p[None, :, :] < p[:, None, :], axis=1)
+    n_equal = np.sum(p[None, :, :] == p[:, None, :], axis=1) - 1
+    return np.where(self.played, n_below + 0.5 * n_equal, 0.)
+
+  def _running_streak(self):
+    """Winning (positive) or losing (negative) streak by margin of victory, as of each week
+
+    :return: streaks with shape (n_teams, n_weeks)
+    """
+    sign = np.sign(self.points - self.opp_points)
+    run = np.zeros(self.team_ids.size)
+    run_sign = np.zeros(self.team_ids.size)
+    streak = np.zeros(self.points.shape)
+    for col in range(self.weeks.size):
+      played = self.played[:, col]
+      run = np.where(played, np.where(sign[:, col] == run_sign, run + 1, 1), run)
+      run_sign = np.where(played, sign[:, col], run_sign)
+      streak[:, col] = run * run_sign
+    return streak
+
+  def week_col(self, week=None):
+    """Column holding the running totals through a week
+
+    :param week: matchup period, the last week of the matrix if None
+    :return: column index into the running totals
+    """
+    if week is None:
+      return self.weeks.size - 1
+    col = np.searchsorted(self.weeks, week, side='right') - 1
+    if col < 0:
+      logger.info(f'No games have been logged by week {week}')
+      raise ValueError(f'No games have been logged by week {week}')
+    return col
+
+  def wins(self):
+    """Number of wins for each team"""
+    return self.totals()['wins'][:, -1]
+
+  def games(self):
+    """Number of decided games for each team"""
+    return self.totals()['games'][:, -1]
+
+  def agg_wins(self):
+    """Aggregate wins, the teams outscored each week with ties counted as half
+
+    :return: aggregate wins for each team and the total number of aggregate games
+    """
+    totals = self.totals()
+    return totals['agg_wins'][:, -1], totals['agg_games'][-1]
+
+  def streak(self):
+    """Current winning (positive) or losing (negative) streak, by margin of victory"""
+    return self.totals()['streak'][:, -1]
+
+  def cons(self):
+    """Consistency, the sum of minimum, maximum and average score, normalized by the league max"""
+    cons = np.nanmin(self.points, axis=1) + np.nanmax(self.points, axis=1) + np.nanmean(self.points, axis=1)
+    return cons / cons.max()
+
+  def opponent_matrix(self):
+    """Number of games each team has played against each other team
+
+    :return: sparse matrix with shape (n_teams, n_teams)
+    """
+    rows, cols = np.nonzero(self.played)
+    n_teams = self.team_ids.size
+    return sparse.csr_matrix((np.ones(rows.size), (rows, self.opponent[rows, cols])), shape=(n_teams, n_teams))
+
+  def sos(self, ratings, rank_power=2.37):
+    """Strength of schedule, the average opponent rating raised to rank_power
+
+    :param ratings: rating for each team, aligned with team_ids
+    :param rank_power: exponent to use in sos calculation
+    :return: sos for each team, normalized by the league max
+    """
+    sos = self.opponent_matrix() @ (np.asarray(ratings, dtype=float) ** rank_power) / self.games()
+    return sos / sos.max()
+
+  def luck(self, awp_weight=0.5):
+    """Luck, weighting the ratio of win pct to aggregate win pct and of opponent average to actual score
+
+    Higher luck boosts un-lucky teams
+    :param awp_weight: relative weight between awp ratio and opp score ratio
+    :return: luck for each team, normalized by the league max
+    """
+    agg_wins, agg_games = self.agg_wins()
+    # Add .01 to num/denom to guard against shitty teams
+    awp_ratio = (0.01 + self.wins() / self.games()) / (0.01 + agg_wins / agg_games)
+    avg_score = np.nanmean(self.points, axis=1)
+    opp_ratio = np.nanmean(np.where(self.played, avg_score[self.opponent] / self.opp_points, np.nan), axis=1)
+    # Luck ranking is the inverse -- rewards unlucky teams
+    luck = 1. / (awp_ratio * awp_weight + opp_ratio * (1 - awp_weight))
+    return luck / luck.max()
+
+  def summary(self, week=None):
+    """Summary of season results as of a week, one row per team
+
+    Read from the running totals, so any week costs one column lookup
+    :param week: matchup period to summarize through, the last week if None
+    :return: data frame with a row for each team
+    """
+    totals = self.totals()
+    col = self.week_col(week)
+    columns = {name: totals[name][:, col] for name in [
+      'home_wins', 'home_games', 'home_points_for', 'home_points_against',
+      'away_wins', 'away_games', 'away_points_for', 'away_points_against',
+      'wins', 'games', 'points_for', 'points_against', 'max_score', 'min_score', 'streak']}
+    # Overall ESPN ranking: dense rank by wins, then points for
+    _, overall = np.unique(np.column_stack([-columns['wins'], -columns['points_for']]), axis=0, return_inverse=True)
+    columns['overall'] = overall.ravel() + 1
+    columns['agg_wins'] = totals['agg_wins'][:, col]
+    columns['agg_games'] = totals['agg_games'][col]
+    columns['agg_wpct'] = columns['agg_wins'] / columns['agg_games']
+    return self.frame(**columns)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""Store simulation results on disk, keyed by a hash of their inputs
+
+Each store is a directory of .npy files under output/{year}/simulations
+holding the summed results of one run. Stores are written to a temporary
+directory and renamed into place once complete, and only the most
+recently used MAX_STORES of each season are kept.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+
+__author__ = 'Ryne Carbone'
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored arrays or the simulation change meaning
+STORE_VERSION = 2
+# Stores kept per season, older ones are removed when a new one is saved
+MAX_STORES = 10
+
+
+def get_store_key(*arrays, **options):
+  """Hash the simulation inputs into a short key
+
+  :param arrays: input arrays, hashed by dtype, shape and contents
+  :param options: simulation options, hashed by name and value
+  :return: hex digest identifying the inputs
+  """
+  digest = hashlib.sha1(f'v{STORE_VERSION}'.encode())
+  for array in arrays:
+    array = np.ascontiguousarray(array)
+    digest.update(f'{array.dtype}{array.shape}'.encode())
+    digest.update(array.tobytes())
+  digest.update(repr(sorted(options.items())).encode())
+  return digest.hexdigest()[:16]
+
+
+def get_store_dir(year, key):
+  """Directory holding the store for a key
+
+  :param year: current year
+  :param key: hash of the simulation inputs
+  :return: path to the store
+  """
+  return Path(f'output/{year}/simulations/{key}')
+
+
+def load_store(year, key):
+  """Load a complete store, marking it as recently used
+
+  :param year: current year
+  :param key: hash of the simulation inputs
+  :return: dictionary of arrays by name, or None if there is no store
+  """
+  store_dir = get_store_dir(year, key)
+  if not store_dir.is_dir():
+    return None
+  logger.info(f'Loading stored simulations from {store_dir}')
+  os.utime(store_dir)
+  return {path.stem: np.load(path) for path in store_dir.glob('*.npy')}
+
+
+def create_store(year, key):
+  """Start a new store in a temporary directory
+
+  :param year: current year
+  :param key: hash of the simulation inputs
+  :return: path to the temporary directory
+  """
+  tmp_dir = get_store_dir(year, key).with_suffix('.tmp')
+  shutil.rmtree(tmp_dir, ignore_errors=True)
+  tmp_dir.mkdir(parents=True)
+  return tmp_dir
+
+
+def save_store(tmp_dir, **arrays):
+  """Write the arrays, move the store into place and prune old stores
+
+  :param tmp_dir: temporary directory from create_store
+  :param arrays: arrays to save, by name
+  :return: path to the completed store
+  """
+  for name, array in arrays.items():
+    np.save(tmp_dir / f'{name}.npy', array)
+  store_dir = tmp_dir.with_suffix('')
+  shutil.rmtree(store_dir, ignore_errors=True)
+  tmp_dir.rename(store_dir)
+  logger.info(f'Saved simulations to {store_dir}')
+  prune_stores(store_dir.parent)
+  return store_dir
+
+
+def prune_stores(sim_dir, max_stores=MAX_STORES):
+  """Remove all but the most recently used stores of a season
+
+  :param sim_dir: directory holding the season's stores
+  :param max_stores: number of stores to keep
+  :return: None
+  """
+  stores = sorted((path for path in sim_dir.iterdir() if path.is_dir() and not path.suffix),
+                  key=lambda path: path.stat().st_mtime, reverse=True)
+  for path in stores[max_stores:]:
+    logger.info(f'Removing old stored simulations {path}')
+    shutil.rmtree(path, ignore_errors=True)
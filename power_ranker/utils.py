@@ -22,120 +22,61 @@ __author__ = 'Ryne Carbone'
 logger = logging.getLogger(__name__)
 
 
-def calc_sos(df_schedule, df_ranks, week, rank_power=2.37):
-  """Calculate the strength of schedule based on lsq rank
+def calc_remaining_sos(df_schedule, df_ranks, df_win_probs, week, reg_season):
+  """Calculate the strength of the remaining schedule from head-to-head win probabilities
 
-  Normalize SOS by max SOS in league
+  Each team's remaining SOS is the average chance its remaining opponents beat it
   :param df_schedule: data frame with team ids for each matchup
-  :param df_ranks: data frame with rankings from lsq metric
+  :param df_ranks: data frame with rankings
+  :param df_win_probs: chance the row team beats the column team, indexed by team id
   :param week: current week
-  :param rank_power: exponent to use in sos calculation
-  :return: data frame of rankings with sos added
-  """
-  sos = lambda iteam, iweek: (
-    df_schedule
-    .query(f'(home_id=={iteam} | away_id=={iteam}) & (matchupPeriodId <= {iweek} & winner != "UNDECIDED")')
-    .apply(lambda x: x.home_id if x.away_id == iteam else x.away_id, axis=1)
-    .apply(lambda x: df_ranks.loc[df_ranks.team_id == x, 'lsq'].values[0])
-    .agg(lambda x: sum(x ** rank_power) / len(x))
-  )
-  df_ranks['sos'] = df_ranks.get('team_id').apply(lambda x: sos(x, week))
-  # Normalize SOS by max SOS calculated
-  df_ranks['sos'] = df_ranks.get('sos') / df_ranks.get('sos').max()
-  return df_ranks
-
-
-def calc_luck(df_season_summary, df_schedule, week, awp_weight=0.5):
-  """Calculate luck ranking
-
-  Takes into account ratio of wins to aggregate wins and ratio
-  of opponents average score to opponents week score.
-  Higher luck ranking boosts un-lucky teams
-
-  :param df_season_summary: data frame with win pct, agg win pct and team id
-  :param df_schedule: data frame with scores for each matchup
-  :param week: current week
-  :param awp_weight: relative weight between awp ratio and opp score ratio
-  :return: data frame with luck ranking
-  """
-  # Calculate ratio of wpct to aggregate wpct (Add .01 to num/denom to guard against shitty teams)
-  df_luck = df_season_summary.apply(
-    lambda x: pd.Series({'team_id': x.team_id,
-                         'awp_ratio': (0.01+x.wins/x.games)/(0.01+x.agg_wpct)}),
-    axis=1)
-  df_luck['opp_ratio'] = df_luck.apply(lambda x: get_opp_score_ratio(df_schedule, x.team_id, week), axis=1)
-  # Calculate the weighted sum of awp ratio and opp score ratio
-  df_luck['luck_ind'] = df_luck.apply(lambda x: x.awp_ratio*awp_weight + x.opp_ratio*(1-awp_weight), axis=1)
-  # Luck ranking is the inverse -- rewards unlucky teams
-  df_luck['luck'] = df_luck.apply(lambda x: 1. / x.luck_ind, axis=1)
-  # Normalize luck ranking by max ranking
-  df_luck['luck'] = df_luck.get('luck') / df_luck.get('luck').max()
-  return df_luck[['team_id', 'luck']].reset_index(drop=True)
-
-
-def get_team_scores(df_schedule, team, week):
-  """Get all scores for a team
-
-  :param df_schedule: data frame with scores and team ids for each game
-  :param team: id for team
-  :param week: current week
-  :return: series of scores for team up to week
+  :param reg_season: length of the regular season
+  :return: data frame of rankings with rsos added (NaN when no games remain)
   """
+  df_remaining = df_schedule.query(f'matchupPeriodId > {week} & matchupPeriodId <= {reg_season}')
+  team_ids = df_win_probs.index.values
+  team_pos = pd.Series(np.arange(team_ids.size), index=team_ids)
+  home_idx = team_pos.loc[df_remaining.home_id.values].values
+  away_idx = team_pos.loc[df_remaining.away_id.values].values
+  p_win = df_win_probs.values
+  # Chance the opponent wins, for the home and the away team of every game
+  team_idx = np.concatenate([home_idx, away_idx])
+  p_opp = np.concatenate([p_win[away_idx, home_idx], p_win[home_idx, away_idx]])
+  n_games = np.bincount(team_idx, minlength=team_ids.size)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    rsos = np.bincount(team_idx, weights=p_opp, minlength=team_ids.size) / n_games
+  df_rsos = pd.DataFrame({'team_id': team_ids, 'rsos': rsos})
   return (
-    df_schedule
-    .query(f'(home_id=={team} | away_id=={team}) & (matchupPeriodId <= {week} & winner != "UNDECIDED")')
-    .apply(lambda x: x.home_total_points if x.home_id == team else x.away_total_points, axis=1)
+    pd.merge(df_ranks, df_rsos, on='team_id', how='left')
+    .sort_values('team_id')
+    .reset_index(drop=True)
   )
 
 
-def get_opp_score_ratio(df_schedule, team, week):
-  """Calculate ratio of opponents average score to opponents score during week they play you
-
-  :param df_schedule: data frame with scores and team ids for each matchup
-  :param team: team id
-  :param week: current week
-  :return: ratio of opponents average score to score during current week
-  """
-  return (
-    df_schedule
-    .query(f'(home_id=={team} | away_id=={team}) & (matchupPeriodId <= {week} & winner != "UNDECIDED")')
-    .apply(lambda x:
-           pd.Series({'opp_score': x.home_total_points,
-                      'opp_avg_score': get_team_scores(df_schedule, x.home_id, week).mean()})
-           if x.away_id == team else
-           pd.Series({'opp_score': x.away_total_points,
-                      'opp_avg_score': get_team_scores(df_schedule, x.away_id, week).mean()}), axis=1)
-    .apply(lambda x: x.opp_avg_score / x.opp_score, axis=1)
-    .agg(lambda x: x.mean())
-  )
+# Metrics combined into the power rankings, in the order of the [Power] weights
+POWER_METRICS = ['dom', 'lsq', 'col', 'awp', 'sos', 'luck', 'cons', 'strk']
 
 
-def calc_cons(df_ranks, df_schedule, week):
-  """Calculate the consistency metric, based on your
-     avg, minimum, and maximum scores
+def get_power_metrics(df_ranks, df_season_summary):
+  """Build the matrix of metrics that are weighted into the power rankings
 
-  :param df_ranks: data frame with rankings for each metric
-  :param df_schedule: data frame with scores and team ids for each game
-  :param week: current week
-  :return: data frame with rankings
+  :param df_ranks: data frame with calculated rankings
+  :param df_season_summary: data frame with summarised data for each team
+  :return: array with shape (n_teams, 8), rows in df_ranks order and columns in POWER_METRICS order
   """
-  logger.debug('Calculating consistency rankings')
-  # Get scores for each team
-  df_scores = df_ranks.apply(
-    lambda x: pd.Series({'team_id': x.team_id,
-                         'scores': get_team_scores(df_schedule, x.team_id, week).values})
-    , axis=1)
-  # Add min, max, and average score
-  df_scores['cons'] = df_scores.apply(lambda x: x.scores.min() + x.scores.max() + x.scores.mean(), axis=1)
-  # Normalize by highest cons score
-  df_scores['cons'] = df_scores.get('cons') / df_scores.get('cons').max()
-  # Merge back into rankings data frame
-  df_ranks  = (
-    pd.merge(df_ranks, df_scores[['team_id', 'cons']].reset_index(drop=True), on='team_id', how='left')
-    .sort_values('team_id')
-    .reset_index(drop=True)
-  )
-  return df_ranks
+  df_sum = df_season_summary.set_index('team_id').reindex(df_ranks.team_id.values)
+  # Only count winning streaks greater than one game
+  streak = df_sum.streak.values
+  return np.column_stack([
+    df_ranks.dom.values,
+    df_ranks.lsq.values,
+    df_ranks.col.values,
+    df_sum.agg_wpct.values,
+    df_ranks.sos.values,
+    df_ranks.luck.values,
+    df_ranks.cons.values,
+    np.where(streak > 1., 0.25*streak, 0.)
+  ])
 
 
 def calc_power(df_ranks, df_season_summary, w_dom=0.18, w_lsq=0.18, w_col=0.18,
@@ -154,26 +95,31 @@ def calc_power(df_ranks, df_season_summary, w_dom=0.18, w_lsq=0.18, w_col=0.18,
   :param w_strk: weight for streak
   """
   logger.debug('Aggregating all power rankings')
-  # Only count winning streaks greater than one game
-  discount_streak = lambda streak: 0.25*streak if streak > 1. else 0
+  weights = np.array([w_dom, w_lsq, w_col, w_awp, w_sos, w_luck, w_cons, w_strk])
   # Combine all ranks with weights
-  df_ranks['power'] = df_ranks.apply(
-    lambda x:
-    w_dom * x.get('dom') +
-    w_lsq * x.get('lsq') +
-    w_col * x.get('col') +
-    w_awp * df_season_summary.loc[df_season_summary.team_id == x.team_id, 'agg_wpct'].values[0] +
-    w_sos * x.get('sos') +
-    w_luck * x.get('luck') +
-    w_cons * x.get('cons') +
-    w_strk * discount_streak(df_season_summary.loc[df_season_summary.team_id == x.team_id, 'streak'].values[0])
-    , axis=1
-  )
+  df_ranks['power'] = get_power_metrics(df_ranks, df_season_summary) @ weights
   # Normalize with hyperbolic tangent
   df_ranks['power'] = 100.*np.tanh(df_ranks['power']/0.5)
   return df_ranks
 
 
+def calc_power_sweep(df_ranks, df_season_summary, weights):
+  """Calculates the power rankings for a batch of weight vectors in one matrix product
+
+  :param df_ranks: data frame with calculated rankings
+  :param df_season_summary: data frame with summarised data for each team
+  :param weights: array with shape (n_weights, 8), columns in POWER_METRICS order
+  :return: data frame of power ranks (1 is best), a row for each weight vector and a column for each team id
+  """
+  weights = np.atleast_2d(np.asarray(weights, dtype=float))
+  if weights.shape[1] != len(POWER_METRICS):
+    raise ValueError(f'Expected weights with {len(POWER_METRICS)} columns ({", ".join(POWER_METRICS)})')
+  # tanh normalization doesn't change the order, so rank the weighted sums directly
+  power = weights @ get_power_metrics(df_ranks, df_season_summary).T
+  ranks = np.argsort(np.argsort(-power, axis=1, kind='stable'), axis=1) + 1
+  return pd.DataFrame(ranks, columns=df_ranks.team_id.values)
+
+
 def calc_tiers(df_ranks, year, week, bw=0.09, order=4, show=False):
   """Calculate 3-5 tiers using Gaussian Kernel Density Estimation
 
@@ -4,31 +4,18 @@
 
 import logging
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from plotnine import *
 import warnings
+from ..score_models import fit_score_model
 
 __author__ = 'Ryne Carbone'
 
 logger = logging.getLogger(__name__)
 
 
-def get_team_scores(df_schedule, team, week):
-  """Get all scores for a team
-
-  :param df_schedule: data frame with scores and team ids for each game
-  :param team: id for team
-  :param week: current week
-  :return: series of scores for team up to week
-  """
-  return (
-    df_schedule
-    .query(f'(home_id=={team} | away_id=={team}) & (matchupPeriodId <= {week} & winner != "UNDECIDED")')
-    .apply(lambda x: x.home_total_points if x.home_id == team else x.away_total_points, axis=1)
-  )
-
-
-def make_power_plot(df_ranks, df_schedule, df_teams, year, week):
+def make_power_plot(df_ranks, df_schedule, df_teams, year, week, score_model='normal'):
   """Create plot of weekly scores and current power rankings
 
   :param df_ranks: data frame with current power rankings
@@ -36,6 +23,7 @@ def make_power_plot(df_ranks, df_schedule, df_teams, year, week):
   :param df_teams: data frame with team names
   :param year: current year
   :param week: current week
+  :param score_model: score model whose cached score matrix is plotted
   :return: None
   """
   # Grab team id and power score, convert power to ranking
@@ -50,10 +38,10 @@ def make_power_plot(df_ranks, df_schedule, df_teams, year, week):
   df_plot['Name'] = df_plot.apply(
     lambda x: df_teams.loc[df_teams.team_id == x.get('team_id'), 'firstName'].values[0],
     axis=1)
-  # Add in weekly scores
-  df_plot['scores'] = df_plot.apply(
-    lambda x: get_team_scores(df_schedule=df_schedule, team=x.get('team_id'), week=week).values,
-    axis=1)
+  # Add in weekly scores, from the score model fit shared with the playoff odds
+  model = fit_score_model(df_schedule=df_schedule, team_ids=df_teams.team_id.values, week=week, model=score_model)
+  scores = dict(zip(df_teams.team_id.values, model.scores))
+  df_plot['scores'] = [scores[team][~np.isnan(scores[team])] for team in df_plot.team_id]
   # Add in where to put labels
   df_plot['label_pos'] = df_plot.scores.apply(lambda x: max(x) + 10)
   # Explode list into a row for each week
@@ -10,6 +10,7 @@ import pkg_resources
 import numpy as np
 import pandas as pd
 from ..history import scrape_history
+from ..get_season_data import build_team_game_table, get_team_games
 
 __author__ = 'Ryne Carbone'
 
@@ -74,11 +75,11 @@ def make_progress_bar(title, value, rank, max_FAAB=100):
     return progress_bar
 
 
-def make_game_log(team_id, df_schedule, df_teams, week):
+def make_game_log(team_id, df_games, df_teams, week):
     """Returns table body for game log
 
     :param team_id: team id for game log
-    :param df_schedule: data frame with all game data
+    :param df_games: team-game table with scores and opponent ids for each game
     :param df_teams: data frame with team information
     :param week: current week
     :return: html table with game log
@@ -87,29 +88,11 @@ def make_game_log(team_id, df_schedule, df_teams, week):
     # Html code for green W or red L
     win = '<span class="text-success">W</span>'
     loss = '<span class="text-danger">L</span>'
-    # Filter schedule for games with team_id
-    df_log = (df_schedule
-              .query(f'(away_id=={team_id} | home_id=={team_id}) & matchupPeriodId<={week} & winner!="UNDECIDED"')
-              .reset_index(drop=True))
-    # Define opponent
-    df_log['opp_id'] = df_log.apply(
-        lambda x: x.get('away_id') if x.get('home_id') == team_id else x.get('home_id'), axis=1
-    )
-    # Define home/away
-    df_log['loc'] = df_log.apply(lambda x: '@' if x.get('away_id') == team_id else '', axis=1)
-    #  Format score for each matchup
-    df_log['Score'] = df_log.apply(
-        lambda x: f'{x.get("away_total_points"):.2f} &mdash; {x.get("home_total_points"):.2f}'
-        if x.get('home_id') == team_id
-        else f'{x.get("home_total_points"):.2f} &mdash; {x.get("away_total_points"):.2f}', axis=1
-    )
-    # Create html formated W/L
-    df_log['Outcome'] = df_log.apply(
-        lambda x: win
-        if ((x.get('home_id') == team_id) & (x.get('winner') == 'HOME')) |
-           ((x.get('away_id') == team_id) & (x.get('winner') == 'AWAY'))
-        else loss, axis=1
-    )
+    # Team's games, opponent first in the score
+    df_log = get_team_games(df_games=df_games, team=team_id, week=week).reset_index()
+    df_log['loc'] = np.where(df_log.home, '', '@')
+    df_log['Score'] = [f'{opp:.2f} &mdash; {pts:.2f}' for opp, pts in zip(df_log.opp_points, df_log.points)]
+    df_log['Outcome'] = np.where(df_log.result == 'W', win, loss)
     # Add in opponent team information
     df_log = pd.merge(
         df_log,
@@ -126,7 +109,7 @@ def make_game_log(team_id, df_schedule, df_teams, week):
     df_log['Opponent'] = df_log.apply(
         lambda x: f'{x.get("loc"):1}{x.get("location")} {x.get("nickname")}', axis=1
     )
-    df_log['Week'] = df_log['matchupPeriodId']
+    df_log['Week'] = df_log['week']
     return (df_log
             [['Week', 'Opponent', 'Owner', 'Score', 'Outcome']]
             .to_html(border=0, index=False, escape=False,
@@ -134,6 +117,45 @@ def make_game_log(team_id, df_schedule, df_teams, week):
                      table_id='progress_table'))
 
 
+def make_matchup_preview(team_id, df_schedule, df_teams, df_win_probs, week, reg_season):
+    """Returns table of remaining games with the chance to win each
+
+    :param team_id: team id for the preview
+    :param df_schedule: data frame with all game data
+    :param df_teams: data frame with team information
+    :param df_win_probs: chance the row team beats the column team, indexed by team id
+    :param week: current week
+    :param reg_season: length of the regular season
+    :return: html table with upcoming games
+    """
+    logger.debug(f'Creating matchup preview for team {team_id}')
+    df_preview = (df_schedule
+                  .query(f'(away_id=={team_id} | home_id=={team_id}) & '
+                         f'matchupPeriodId>{week} & matchupPeriodId<={reg_season}')
+                  [['matchupPeriodId', 'home_id', 'away_id']]
+                  .reset_index(drop=True))
+    home = (df_preview.home_id == team_id).values
+    df_preview['opp_id'] = np.where(home, df_preview.away_id, df_preview.home_id)
+    df_preview['loc'] = np.where(home, '', '@')
+    df_preview['Win Prob.'] = [f'{100*p:.0f}%' for p in df_win_probs.loc[team_id, df_preview.opp_id].values]
+    # Add in opponent team information
+    df_preview = pd.merge(
+        df_preview,
+        df_teams[['team_id', 'firstName', 'lastName', 'location', 'nickname']],
+        left_on='opp_id',
+        right_on='team_id',
+        how='left'
+    )
+    df_preview['Owner'] = df_preview.firstName + ' ' + df_preview.lastName
+    df_preview['Opponent'] = df_preview['loc'] + df_preview.location + ' ' + df_preview.nickname
+    df_preview['Week'] = df_preview['matchupPeriodId']
+    return (df_preview
+            [['Week', 'Opponent', 'Owner', 'Win Prob.']]
+            .to_html(border=0, index=False, escape=False,
+                     classes=['table', 'table-striped', 'col-md-6'],
+                     table_id='preview_table'))
+
+
 def make_power_table(df_teams, df_ranks, df_sum):
     """Creates simple table with rankings
 
@@ -210,8 +232,9 @@ def get_player_drop(teams, level=''):
     )
 
 
-def make_teams_page(df_teams, df_sum, df_ranks, df_schedule, year, week, league_name, settings):
-    """Make teams page with stats, standings, game log, radar plots
+def make_teams_page(df_teams, df_sum, df_ranks, df_schedule, year, week, league_name, settings, df_win_probs=None,
+                    df_games=None):
+    """Make teams page with stats, standings, game log, matchup previews, radar plots
 
     :param df_teams: data frame with basic data about each team
     :param df_sum: data frame with season summary statistics
@@ -221,9 +244,13 @@ def make_teams_page(df_teams, df_sum, df_ranks, df_schedule, year, week, league_
     :param week: current week
     :param league_name: league name
     :param settings: dictionary with league settings
+    :param df_win_probs: chance the row team beats the column team, for the matchup previews
+    :param df_games: team-game table for the game logs, built from df_schedule if missing
     :return: None
     """
     logger.debug('Creating team html pages')
+    if df_games is None:
+        df_games = build_team_game_table(df_schedule)
     # local_file: fill {year}, {firstName}, {lastName}
     local_file = 'output/{}/{}_{}/index.html'
     # Define template team page location
@@ -296,7 +323,7 @@ def make_teams_page(df_teams, df_sum, df_ranks, df_schedule, year, week, league_
            'INSERTRECORD', 'INSERTACQUISITIONS', 'INSERTTRADES', 'INSERTWAIVER', 'OVERALLRANK',
            'POWERRANK', 'AGGREGATEPCT', 'RADARPLOT', 'PLAYERRANKINGPLOT', 'PLAYERDROPDOWN',
            'INSERT_TPF_PB', 'INSERT_TPA_PB', 'INSERT_HS_PB', 'INSERT_LS_PB', 'INSERT_FAAB_PB',
-           'INSERTTABLEBODY']
+           'INSERTTABLEBODY', 'INSERTPREVIEWBODY']
     df_page['rep'] = df_page.apply(
         lambda x: [
             f'{x.get("owner")}',
@@ -320,7 +347,10 @@ def make_teams_page(df_teams, df_sum, df_ranks, df_schedule, year, week, league_
             x.get('hs_pb'),
             x.get('ls_pb'),
             x.get('faab_pb'),
-            make_game_log(team_id=x.get('team_id'), df_schedule=df_schedule, df_teams=df_teams, week=week)
+            make_game_log(team_id=x.get('team_id'), df_games=df_games, df_teams=df_teams, week=week),
+            make_matchup_preview(team_id=x.get('team_id'), df_schedule=df_schedule, df_teams=df_teams,
+                                 df_win_probs=df_win_probs, week=week, reg_season=settings.reg_season_count)
+            if df_win_probs is not None else ''
         ], axis=1)
     # Output template with replacements
     _ = df_page.apply(
@@ -464,7 +494,8 @@ def copy_css_js_themes(year):
 
 
 def generate_web(df_teams, df_ranks, df_season_summary, df_schedule, year, week, league_id, league_name,
-                 settings, endpoint_history, params, cookies=None, doSetup=True):
+                 settings, endpoint_history, params, cookies=None, df_win_probs=None, doSetup=True,
+                 df_games=None):
     """
     Makes power rankings page, team summary page, about page
 
@@ -480,7 +511,9 @@ def generate_web(df_teams, df_ranks, df_season_summary, df_schedule, year, week,
     :param endpoint_history: history api endpoint
     :param params: api parameters
     :param cookies: cookies for private league
+    :param df_win_probs: chance the row team beats the column team, for the matchup previews
     :param doSetup: flag to download bootstrap css/js themes to make html pretty and create the about page
+    :param df_games: team-game table for the game logs, built from df_schedule if missing
     :return: None
     """
     if doSetup:
@@ -509,7 +542,9 @@ def generate_web(df_teams, df_ranks, df_season_summary, df_schedule, year, week,
         year=year,
         week=week,
         league_name=league_name,
-        settings=settings)
+        settings=settings,
+        df_win_probs=df_win_probs,
+        df_games=df_games)
     make_welcome_page(
         year=year,
         week=week,
@@ -0,0 +1,125 @@
+
+"""Benchmark the playoff simulations on a synthetic league"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from power_ranker.playoff_odds import get_remaining_games, run_simulation, compare_variance_reduction
+
+__author__ = 'Ryne Carbone'
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    stream=sys.stdout,
+                    level=logging.WARNING)
+logger = logging.getLogger('power_ranker_benchmark')
+
+
+def make_league(n_teams=12, n_divisions=2, reg_season=13, week=6, seed=0):
+  """Create a synthetic league with fitted scores and a round robin schedule
+
+  :param n_teams: number of teams in the league (even)
+  :param n_divisions: number of divisions
+  :param reg_season: length of the regular season
+  :param week: current week
+  :param seed: seed for the random team profiles
+  :return: teams data frame and schedule data frame
+  """
+  rng = np.random.default_rng(seed)
+  team_ids = np.arange(1, n_teams+1)
+  teams = pd.DataFrame({
+    'team_id': team_ids,
+    'firstName': [f'Team{t}' for t in team_ids],
+    'divisionId': team_ids % n_divisions,
+    'wins': rng.integers(0, week+1, n_teams).astype(float),
+    'points_for': rng.normal(110*week, 50, n_teams),
+  })
+  teams['score_fit'] = list(zip(rng.normal(110, 12, n_teams), rng.uniform(15, 25, n_teams)))
+  # Circle method: fix the first team, rotate the rest each week
+  games = []
+  order = list(team_ids)
+  for period in range(1, reg_season+1):
+    games += [(order[i], order[-1-i], period) for i in range(n_teams//2)]
+    order = [order[0], order[-1]] + order[1:-1]
+  schedule = pd.DataFrame(games, columns=['home_id', 'away_id', 'matchupPeriodId'])
+  return teams, schedule
+
+
+def run_scaling(n_sims, chunk_size, max_workers, seed, reg_season=13, week=6):
+  """Report simulation throughput from 1 to max_workers processes
+
+  Every worker count runs the same path as the playoff odds, and is checked
+  against the default single process run with the same seed
+  :param n_sims: number of simulations to run for each worker count
+  :param chunk_size: number of simulations per chunk
+  :param max_workers: largest number of processes to try
+  :param seed: seed for the simulations
+  :param reg_season: length of the regular season
+  :param week: current week
+  :return: data frame with timing for each worker count
+  """
+  teams, schedule = make_league(reg_season=reg_season, week=week)
+  rows = []
+  reference = None
+  for n_workers in range(1, max_workers+1):
+    t_start = time.perf_counter()
+    df_results, *_ = run_simulation(
+      teams=teams,
+      schedule=schedule,
+      week=week,
+      reg_season=reg_season,
+      n_sims=n_sims,
+      n_wc=2,
+      year=None,
+      chunk_size=chunk_size,
+      n_workers=n_workers,
+      seed=seed,
+      exact_games=-1,
+      plot=False)
+    elapsed = time.perf_counter() - t_start
+    # Results should not depend on the number of workers
+    if reference is None:
+      reference = df_results
+    rows.append({'workers': n_workers,
+                 'seconds': elapsed,
+                 'sims/s': n_sims / elapsed,
+                 'speedup': rows[0]['seconds'] / elapsed if rows else 1.,
+                 'identical': df_results.equals(reference)})
+  return pd.DataFrame(rows)
+
+
+def main():
+  """Run the playoff simulation scaling benchmark from the command line"""
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-n', '--n-sims', type=int, default=200000,
+                      help='Number of simulations for each worker count')
+  parser.add_argument('-c', '--chunk-size', type=int, default=10000,
+                      help='Number of simulations per chunk')
+  parser.add_argument('-w', '--max-workers', type=int, default=os.cpu_count(),
+                      help='Largest number of worker processes to try')
+  parser.add_argument('-s', '--seed', type=int, default=2019,
+                      help='Seed for the simulations')
+  parser.add_argument('--compare-variance', action='store_true',
+                      help='Compare variance reduction methods instead of worker scaling')
+  args = parser.parse_args()
+  if args.compare_variance:
+    teams, schedule = make_league()
+    df_remaining = get_remaining_games(teams=teams, schedule=schedule, week=6, reg_season=13)
+    df_compare = compare_variance_reduction(teams=teams,
+                                            df_remaining=df_remaining,
+                                            n_wc=2,
+                                            n_sims=args.chunk_size,
+                                            seed=args.seed)
+    print(df_compare.to_string(index=False, float_format='%.4g'))
+    return
+  df_scaling = run_scaling(n_sims=args.n_sims,
+                           chunk_size=args.chunk_size,
+                           max_workers=args.max_workers,
+                           seed=args.seed)
+  print(df_scaling.to_string(index=False, float_format='%.2f'))
+
+
+if __name__ == '__main__':
+  main()
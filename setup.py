@@ -24,17 +24,18 @@ setup(name='power_ranker',
         'configparser',
         'lxml',
         'matplotlib',
-        'numpy',
+        'numpy>=1.17',
         'pandas',
         'requests',
-        'scipy',
+        'scipy>=1.4',
         'plotnine'
       ],
       python_requires='>=3.6',
       entry_points={
         'console_scripts': [
           'power_ranker = scripts.command_line:main',
-          'copy_config = scripts.command_line:copy_config'
+          'copy_config = scripts.command_line:copy_config',
+          'power_ranker_benchmark = scripts.benchmark:main'
         ]
       },
       zip_safe=False)
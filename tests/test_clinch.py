@@ -0,0 +1,77 @@
+import time
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from power_ranker.clinch import calc_clinch_status
+
+
+def make_league(n_teams, n_divisions, n_weeks, n_played, seed):
+  """Round robin league with random results for the weeks played"""
+  rng = np.random.default_rng(seed)
+  order = list(range(n_teams))
+  games = []
+  for _ in range(n_weeks):
+    games += [(order[i], order[-1-i]) for i in range(n_teams//2)]
+    order = [order[0], order[-1]] + order[1:-1]
+  games = np.array(games)
+  n_done = n_played * (n_teams//2)
+  winners = np.where(rng.random(n_done) < 0.5, games[:n_done, 0], games[:n_done, 1])
+  teams = pd.DataFrame({'team_id': np.arange(n_teams) + 1,
+                        'divisionId': np.arange(n_teams) % n_divisions,
+                        'wins': np.bincount(winners, minlength=n_teams).astype(float)})
+  df_remaining = pd.DataFrame(games[n_done:], columns=['home_idx', 'away_idx'])
+  return teams, df_remaining
+
+
+def misses(final_wins, divisions, team, n_wc, ties_to_team):
+  """Check if the team misses the playoffs given every team's final wins"""
+  above = final_wins > final_wins[team] if ties_to_team else final_wins >= final_wins[team]
+  above[team] = False
+  counts = np.bincount(divisions[above], minlength=divisions.max()+1)
+  return counts[divisions[team]] > 0 and np.maximum(counts - 1, 0).sum() >= n_wc
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('n_wc', [1, 2])
+def test_matches_brute_force(seed, n_wc):
+  teams, df_remaining = make_league(n_teams=6, n_divisions=2, n_weeks=6, n_played=3, seed=seed)
+  games = df_remaining.values
+  wins = teams.wins.values
+  divisions = teams.divisionId.values
+  df_status = calc_clinch_status(teams, df_remaining, n_wc)
+  for team in range(wins.size):
+    own = np.any(games == team, axis=1)
+    can_make = False
+    # Fewest wins that get the team in, whatever the other results
+    magic = np.inf
+    for home_wins in itertools.product([True, False], repeat=games.shape[0]):
+      winners = np.where(home_wins, games[:, 0], games[:, 1])
+      final_wins = wins + np.bincount(winners, minlength=wins.size)
+      can_make |= not misses(final_wins, divisions, team, n_wc, ties_to_team=True)
+    for n_wins in range(own.sum() + 1):
+      safe = True
+      for home_wins in itertools.product([True, False], repeat=games.shape[0]):
+        winners = np.where(home_wins, games[:, 0], games[:, 1])
+        if np.sum(winners[own] == team) < n_wins:
+          continue
+        final_wins = wins + np.bincount(winners, minlength=wins.size)
+        safe &= not misses(final_wins, divisions, team, n_wc, ties_to_team=False)
+      if safe:
+        magic = n_wins
+        break
+    row = df_status.iloc[team]
+    assert row.eliminated_playoffs == (not can_make)
+    assert row.clinched_playoffs == (magic == 0)
+    if not row.eliminated_playoffs:
+      assert (np.isnan(row.magic_number) and magic == np.inf) or row.magic_number == magic
+
+
+@pytest.mark.parametrize('n_teams', [16, 20])
+def test_large_league_is_fast(n_teams):
+  # Week 1 of a 4 division league is the slowest case, every team can still catch every other
+  teams, df_remaining = make_league(n_teams=n_teams, n_divisions=4, n_weeks=13, n_played=1, seed=0)
+  t_start = time.perf_counter()
+  df_status = calc_clinch_status(teams, df_remaining, n_wc=4)
+  assert time.perf_counter() - t_start < 5
+  assert not df_status.clinched_playoffs.any() and not df_status.eliminated_playoffs.any()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from power_ranker.score_models import SCORE_MODELS
+
+
+def make_scores(seed=0):
+  """Four weeks of scores for six teams, the first without a decided game and the second with one"""
+  rng = np.random.default_rng(seed)
+  scores = rng.normal(110, 20, (6, 4))
+  scores[0] = np.nan
+  scores[1, 1:] = np.nan
+  return scores
+
+
+@pytest.mark.parametrize('name', sorted(SCORE_MODELS))
+def test_teams_without_scores(name):
+  scores = make_scores()
+  model = SCORE_MODELS[name](scores)
+  assert np.all(np.isfinite(model.mean))
+  assert np.all(model.std > 0)
+  z = np.random.default_rng(1).standard_normal((2000, 6))
+  sims = model.transform(z, np.arange(6))
+  assert np.all(np.isfinite(sims))
+  # The teams short of scores vary like the rest of the league
+  assert sims[:, 0].std() > 5 and sims[:, 1].std() > 5
+  probs = model.win_prob_matrix()
+  assert np.all(np.isfinite(probs))
+  np.testing.assert_allclose(probs + probs.T, 1)
+
+
+def test_fallback_to_league():
+  scores = make_scores()
+  model = SCORE_MODELS['normal'](scores)
+  league = scores[~np.isnan(scores)]
+  assert model.mean[0] == pytest.approx(league.mean())
+  assert model.mean[1] == pytest.approx(scores[1, 0])
+  assert model.std[0] == model.std[1] == pytest.approx(league.std())